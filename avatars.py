@@ -0,0 +1,120 @@
+'''
+Content-addressed avatar storage: originals in MongoDB GridFS, metadata and pre-rendered thumbnails in Redis.
+'''
+
+from hashlib import sha256
+from gridfs import GridFSBucket
+from gridfs.errors import FileExists
+from PyQt5.QtCore import Qt, QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QImage, QImageReader
+from instrument import measure
+
+class AVATAR_STORE:
+    REF_PREFIX = 'sha256:' # what the members' avatar keys hold instead of a path
+    SIZES = [128, 48] # px, the pre-rendered bounding squares
+    META = 'avatar:%s' # hash: sha256, bytes, mime, width, height, sizes
+    RENDITION = 'avatar:%s:%d' # PNG of 1 size
+    BUCKET = 'avatars' # GridFS, originals under their hash as _id
+    MIME = {'jpeg': 'image/jpeg', 'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif', 'bmp': 'image/bmp', 'webp': 'image/webp'}
+
+def isRef(ava: str) -> bool:
+    return ava is not None and ava.startswith(AVATAR_STORE.REF_PREFIX)
+
+def readScaled(reader: QImageReader, size: int) -> QImage:
+    '''
+    The reader downsizes while decoding where the format allows it (JPEG), the full image is never kept
+    '''
+    reader.setAutoTransform(True)
+    full = reader.size()
+    if full.isValid() and (full.width() > size or full.height() > size):
+        reader.setScaledSize(full.scaled(size, size, Qt.KeepAspectRatio))
+    img = reader.read()
+    if img.isNull():
+        raise IOError('Cannot read image: %s' % reader.errorString())
+    if img.width() > size or img.height() > size: # formats ignoring setScaledSize
+        img = img.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return img
+
+def imageReader(data: bytes) -> QImageReader:
+    '''
+    Reads an image held in memory
+    '''
+    buf = QBuffer()
+    buf.setData(QByteArray(data))
+    buf.open(QIODevice.ReadOnly)
+    reader = QImageReader(buf)
+    reader._buffer = buf # the reader does not own its device
+    return reader
+
+def _png(img: QImage) -> bytes:
+    buf = QBuffer()
+    buf.open(QIODevice.WriteOnly)
+    img.save(buf, 'PNG')
+    return bytes(buf.data())
+
+class AvatarStore:
+    '''
+    ingest(path) stores an image once per content and returns its reference, rendition(ref, size) is all a client reads.
+    Rendering uses Qt's image readers, so ingest on a worker thread of the app.
+    An ingest is recorded as ingestAvatar per backend, storing the renditions as ingestAvatar:fill.
+    '''
+
+    def __init__(self, redis, mongoDb):
+        self.redis = redis
+        self.bucket = GridFSBucket(mongoDb, bucket_name=AVATAR_STORE.BUCKET)
+
+    def ingest(self, path: str) -> str:
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = sha256(data).hexdigest()
+        ref = AVATAR_STORE.REF_PREFIX + digest
+        if measure('redis', 'ingestAvatar', self.redis.exists, AVATAR_STORE.META % digest):
+            return ref # already stored, by anyone
+
+        probe = imageReader(data)
+        fmt = bytes(probe.format()).decode('ascii')
+        full = probe.size()
+        if fmt == '' or not full.isValid():
+            raise IOError('Not an image: %s' % path)
+        mime = AVATAR_STORE.MIME.get(fmt, 'image/' + fmt)
+
+        def upload():
+            try:
+                self.bucket.upload_from_stream_with_id(digest, digest, data, metadata={'mime': mime})
+            except FileExists:
+                pass # ignore, a concurrent ingest of the same image
+
+        measure('mongo', 'ingestAvatar', upload)
+
+        pipe = self.redis.pipeline(transaction=True)
+        for size in AVATAR_STORE.SIZES:
+            pipe.set(AVATAR_STORE.RENDITION % (digest, size), _png(readScaled(imageReader(data), size)))
+        pipe.hset(AVATAR_STORE.META % digest, mapping={
+            'sha256': digest,
+            'bytes': len(data),
+            'mime': mime,
+            'width': full.width(),
+            'height': full.height(),
+            'sizes': ','.join(str(s) for s in AVATAR_STORE.SIZES)
+        }) # last: its presence means the renditions are there
+        measure('redis', 'ingestAvatar:fill', pipe.execute)
+        return ref
+
+    def meta(self, ref: str) -> dict:
+        dat = self.redis.hgetall(AVATAR_STORE.META % ref[len(AVATAR_STORE.REF_PREFIX):])
+        return {k.decode('UTF-8'): v.decode('UTF-8') for k, v in dat.items()}
+
+    def rendition(self, ref: str, size: int = AVATAR_STORE.SIZES[0]) -> bytes:
+        '''
+        PNG of the smallest pre-rendered size covering size, None if the avatar is unknown
+        '''
+        fit = [s for s in AVATAR_STORE.SIZES if s >= size]
+        size = min(fit) if len(fit) > 0 else max(AVATAR_STORE.SIZES)
+        return self.redis.get(AVATAR_STORE.RENDITION % (ref[len(AVATAR_STORE.REF_PREFIX):], size))
+
+    def original(self, ref: str) -> bytes:
+        stream = self.bucket.open_download_stream(ref[len(AVATAR_STORE.REF_PREFIX):])
+        try:
+            return stream.read()
+        finally:
+            stream.close()
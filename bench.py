@@ -0,0 +1,227 @@
+'''
+Headless benchmark of the db.Wrapper operations, at several data scales and concurrency levels.
+
+    python bench.py --scales 0.1 1 --concurrency 1 4 16 --output bench-results.json
+
+Each scale recreates the sample databases with synthetic_data.SyntheticData (--no-seed benchmarks the data as it is).
+Results are written as JSON, together with the commit they were measured on, so that runs can be compared.
+'''
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from uuid import uuid4
+from synthetic_data import SYNTHETIC, SyntheticData
+
+class BENCH:
+    ITERATIONS = 200 # calls per operation and concurrency level
+    WARMUP = 10 # untimed calls first, to fill the pools and the servers' caches
+    HEAVY_SHARE = 10 # full-table reads get ITERATIONS / HEAVY_SHARE calls
+    PERCENTILES = [50, 95, 99]
+
+class BenchOp:
+    '''
+    prepare(dbWrapper, rng, n) -> list of n argument tuples, untimed. fn(dbWrapper, *args) is the timed call.
+    cleanup(dbWrapper) runs untimed once measured, it removes what the calls added (--no-seed runs on real data).
+    '''
+
+    def __init__(self, name: str, fn, prepare=None, heavy: bool = False, cleanup=None):
+        self.name = name
+        self.fn = fn
+        self.prepare = prepare or (lambda dbWrapper, rng, n: [()] * n)
+        self.heavy = heavy
+        self.cleanup = cleanup
+
+# ----- arguments of the operations
+
+def _employeeRows(dbWrapper, rng, n):
+    rows, cursor = dbWrapper.getEmployeePage(limit=max(n, 1))
+    rows = [(eid, name, str(birth), male, job, dep, branch) for eid, name, birth, male, job, dep, branch in rows] # str of a Neo4j date is ISO
+    return [rng.choice(rows) for i in range(n)] # written back unchanged
+
+def _newEmployees(dbWrapper, rng, n):
+    eids = ['BENCH%d' % i for i in range(n)]
+    dbWrapper.changeEmps([dbWrapper._empRow(eid, 'Bench', '1990-01-01', True, 'Nhân viên', 'Kinh doanh', 'The Coffee House 1') for eid in eids])
+    return [(eid,) for eid in eids]
+
+def _productRows(dbWrapper, rng, n):
+    rows, cursor = dbWrapper.getProductPage(limit=max(n, 1))
+    rows = [(pid, name, on, sfrom.isoformat(), price, ptype) for pid, name, on, sfrom, price, ptype in rows]
+    return [rng.choice(rows) for i in range(n)] # written back unchanged
+
+def _newProducts(dbWrapper, rng, n):
+    tag = rng.getrandbits(32) # product names are unique
+    return [(dbWrapper.createProd('Bench %d-%d' % (tag, i), 1, '2014-01-01', 10000, 'Cà phê Việt Nam'),) for i in range(n)]
+
+_createdProducts = [] # by createProd, appended to from the worker threads
+
+def _createProd(dbWrapper):
+    _createdProducts.append(dbWrapper.createProd('Bench %s' % uuid4().hex, 1, '2014-01-01', 10000, 'Cà phê Việt Nam'))
+
+def _delCreatedProducts(dbWrapper):
+    pids = list(_createdProducts)
+    del _createdProducts[:]
+    if len(pids) > 0:
+        dbWrapper.delProds(pids)
+
+def _memberCount(dbWrapper) -> int:
+    return dbWrapper.mongoDb['mems'].estimated_document_count() - SYNTHETIC.SAMPLE_MEMBERS
+
+def _logins(dbWrapper, rng, n):
+    count = _memberCount(dbWrapper)
+    if count <= 0:
+        return [('Doraemon', SYNTHETIC.PASSWORD)] * n # fixed data only: times the wrong password path
+    return [('member%d' % rng.randint(1, count), SYNTHETIC.PASSWORD) for i in range(n)]
+
+def _memberIDs(dbWrapper, rng, n):
+    count = _memberCount(dbWrapper)
+    if count <= 0:
+        return [('TCHMID0000001YS',)] * n
+    return [(SyntheticData.memberID(rng.randrange(count)),) for i in range(n)]
+
+def _memberInfos(dbWrapper, rng, n):
+    infos = []
+    for uid, in _memberIDs(dbWrapper, rng, min(n, 100)):
+        dat = dbWrapper.mongoDb['mems'].find_one({'id': uid})
+        dat['ava'] = dbWrapper.getMemAvatarPath(uid) or 'assets/avatars/default.png'
+        infos.append((dat,)) # saved back unchanged
+    return [rng.choice(infos) for i in range(n)]
+
+OPS = [
+    BenchOp('getEmployees', lambda w: w.getEmployees(), heavy=True),
+    BenchOp('getEmployeePage', lambda w: w.getEmployeePage()),
+    BenchOp('changeEmp', lambda w, *row: w.changeEmp(*row), _employeeRows),
+    BenchOp('delEmp', lambda w, eid: w.delEmp(eid), _newEmployees),
+    BenchOp('getProducts', lambda w: w.getProducts(), heavy=True),
+    BenchOp('getProductPage', lambda w: w.getProductPage()),
+    BenchOp('changeProd', lambda w, *row: w.changeProd(*row), _productRows),
+    BenchOp('createProd', _createProd, cleanup=_delCreatedProducts),
+    BenchOp('delProd', lambda w, pid: w.delProd(pid), _newProducts),
+    BenchOp('memLogin', lambda w, acc, pw: w.memLogin(acc, pw), _logins),
+    BenchOp('getMemAvatarPath', lambda w, uid: w.getMemAvatarPath(uid), _memberIDs),
+    BenchOp('saveMemInfo', lambda w, dat: w.saveMemInfo(dat), _memberInfos),
+]
+
+# ----- measuring
+
+def percentile(sortedValues: list, p: float) -> float:
+    '''
+    Nearest-rank percentile of an already sorted list
+    '''
+    if len(sortedValues) == 0:
+        return None
+    rank = max(1, int(round(p / 100.0 * len(sortedValues) + 0.4999)))
+    return sortedValues[min(rank, len(sortedValues)) - 1]
+
+def measure(dbWrapper, op: BenchOp, concurrency: int, iterations: int, rng: random.Random) -> dict:
+    n = max(1, iterations // BENCH.HEAVY_SHARE) if op.heavy else iterations
+    warmup = min(BENCH.WARMUP, n)
+    args = op.prepare(dbWrapper, rng, n + warmup) # distinct rows for the deletes, so warming up does not use the timed ones
+
+    def call(a):
+        start = time.perf_counter()
+        try:
+            op.fn(dbWrapper, *a)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    try:
+        for a in args[:warmup]:
+            try:
+                op.fn(dbWrapper, *a)
+            except:
+                pass # ignore, errors are counted in the timed calls
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(call, args[warmup:]))
+        wall = time.perf_counter() - start
+    finally:
+        if op.cleanup is not None:
+            op.cleanup(dbWrapper)
+
+    latencies = sorted(t for t, e in outcomes if e is None)
+    errors = [e for t, e in outcomes if e is not None]
+    res = {
+        'op': op.name,
+        'concurrency': concurrency,
+        'calls': len(outcomes),
+        'errors': len(errors),
+        'throughput': len(latencies) / wall if wall > 0 else None,
+        'mean_ms': sum(latencies) / len(latencies) * 1000 if len(latencies) > 0 else None,
+        'max_ms': latencies[-1] * 1000 if len(latencies) > 0 else None,
+    }
+    for p in BENCH.PERCENTILES:
+        value = percentile(latencies, p)
+        res['p%d_ms' % p] = None if value is None else value * 1000
+    if len(errors) > 0:
+        res['first_error'] = repr(errors[0])
+    return res
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return None # ignore, not a git checkout
+
+def _fmt(value) -> str:
+    return '-' if value is None else '%.2f' % value
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the db.Wrapper operations.')
+    parser.add_argument('--credentials', default='db_credentials.json', help='DBMS connection information, as for the app')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.1], help='synthetic data scales, see synthetic_data.py')
+    parser.add_argument('--no-seed', action='store_true', help='benchmark the existing data instead of seeding each scale')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--iterations', type=int, default=BENCH.ITERATIONS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ops', nargs='+', choices=[op.name for op in OPS], help='only these operations')
+    parser.add_argument('--output', default='bench-results.json')
+    args = parser.parse_args()
+
+    from db import Wrapper # imported late so --help works without the drivers
+    ops = [op for op in OPS if args.ops is None or op.name in args.ops]
+    scales = [None] if args.no_seed else args.scales
+    report = {
+        'commit': _commit(),
+        'started': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': vars(args),
+        'results': []
+    }
+
+    dbWrapper = Wrapper()
+    dbWrapper.connect(args.credentials)
+    try:
+        for scale in scales:
+            if scale is not None:
+                counts = {key: int(SYNTHETIC.PROFILE[key] * scale) for key in SYNTHETIC.PROFILE}
+                print('Seeding scale %s: %s...' % (scale, counts))
+                dbWrapper.sampleData = SyntheticData(dbWrapper.mysqlCur, dbWrapper.neo4jSess, dbWrapper.mongo, dbWrapper.redis, dbWrapper.credentials, dbWrapper.neo4j, counts, args.seed)
+                dbWrapper.createSampleData()
+            dbWrapper.pickupDatabase()
+
+            print('%-18s %5s %7s %6s %10s %9s %9s %9s' % ('scale %s' % ('existing' if scale is None else scale), 'conc', 'calls', 'errors', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+            for concurrency in args.concurrency:
+                for op in ops:
+                    rng = random.Random('%s-%s-%s-%s' % (args.seed, scale, concurrency, op.name)) # same calls on every run
+                    res = measure(dbWrapper, op, concurrency, args.iterations, rng)
+                    res['scale'] = scale
+                    report['results'].append(res)
+                    print('%-18s %5d %7d %6d %10s %9s %9s %9s' % (op.name, concurrency, res['calls'], res['errors'], _fmt(res['throughput']), _fmt(res['p50_ms']), _fmt(res['p95_ms']), _fmt(res['p99_ms'])))
+    finally:
+        dbWrapper.disconnect()
+
+    report['finished'] = datetime.now().isoformat()
+    with open(args.output, 'w', encoding='UTF-8') as f:
+        json.dump(report, f, indent=2, default=str)
+    print('Results written to %s' % args.output)
+
+if __name__ == '__main__':
+    main()
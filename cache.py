@@ -0,0 +1,208 @@
+'''
+Redis read-through caches in front of the other DBMSs.
+'''
+
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from hashlib import sha1
+from instrument import measure, countRows
+
+class CACHE:
+    TTL = 3600 # seconds, entries of outdated versions just expire
+    PRODUCT_VERSION = 'catalogue:version'
+    PRODUCT_PREFIX = 'catalogue:v%d:d:' # d: Decimals stored exactly, entries of the older float encoding are not read
+    MEMBER_TTL = 24 * 3600 # seconds since the last login or save
+    MEMBER = 'member:%s' # hash of the profile, by id
+    MEMBER_BY_USERNAME = 'member:username:%s' # -> id
+    MEMBER_FIELDS = ['id', 'username', 'password', 'level', 'fullname', 'birth', 'phone', 'email', 'address', 'ava']
+
+def _encode(value):
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'dec': str(value)} # exact: a price in a keyset cursor is compared for equality
+    raise TypeError('Cannot cache %r' % value)
+
+def _decode(obj):
+    if len(obj) == 1 and 'd' in obj:
+        return date.fromisoformat(obj['d'])
+    if len(obj) == 1 and 'dec' in obj:
+        return Decimal(obj['dec'])
+    return obj
+
+class ProductCache:
+    '''
+    Caches the catalogue reads of a ProductRepository in Redis, under keys of the current catalogue version.
+    Writers bump the version once their write is committed: readers then miss, and whatever an older read
+    stores lands under a version nobody reads any more, so a client never gets a list older than its read.
+    Redis errors are logged and the reads fall back to MySQL.
+    Each read is recorded per backend: the lookup under redis, the load of a miss under mysql, storing it as op:fill.
+    '''
+
+    def __init__(self, redis, repository):
+        self.redis = redis
+        self.repository = repository
+
+    def _version(self) -> int:
+        v = self.redis.get(CACHE.PRODUCT_VERSION)
+        return 0 if v is None else int(v)
+
+    def _lookup(self, name: str) -> tuple:
+        key = CACHE.PRODUCT_PREFIX % self._version() + name
+        return key, self.redis.get(key)
+
+    def _read(self, op: str, name: str, load, rows=countRows):
+        '''
+        load() -> the value from MySQL on a miss, rows(value) -> its row count
+        '''
+        try:
+            key, cached = measure('redis', op, self._lookup, name, rows=None)
+            if cached is not None:
+                return json.loads(cached, object_hook=_decode)
+        except Exception as e:
+            logging.warning('[Redis] product cache unavailable: %r' % e)
+            return measure('mysql', op, load, rows=rows)
+
+        value = measure('mysql', op, load, rows=rows)
+        try:
+            measure('redis', '%s:fill' % op, self.redis.set, key, json.dumps(value, default=_encode), ex=CACHE.TTL, rows=None)
+        except Exception as e:
+            logging.warning('[Redis] product cache unavailable: %r' % e)
+        return value
+
+    def invalidate(self) -> None:
+        try:
+            self.redis.incr(CACHE.PRODUCT_VERSION)
+        except Exception as e:
+            logging.warning('[Redis] product cache could not be invalidated: %r' % e) # then the entries expire with their TTL
+
+    def getAll(self) -> list:
+        return [tuple(r) for r in self._read('getProducts', 'all', lambda: [list(r) for r in self.repository.getAll()])]
+
+    def getTypes(self) -> list:
+        return self._read('getProductTypes', 'types', self.repository.getTypes)
+
+    def getPage(self, ptype: str = None, sortKey: str = 'id', ascending: bool = True, after: tuple = None, limit: int = 200) -> tuple:
+        args = [ptype, sortKey, ascending, None if after is None else list(after), limit]
+        name = 'page:' + sha1(json.dumps(args, default=_encode).encode('UTF-8')).hexdigest()
+
+        def load():
+            rows, cursor = self.repository.getPage(ptype, sortKey, ascending, after, limit)
+            return [[list(r) for r in rows], None if cursor is None else list(cursor)]
+
+        rows, cursor = self._read('getProductPage', name, load, lambda value: len(value[0]))
+        return [tuple(r) for r in rows], (None if cursor is None else tuple(cursor))
+
+class MemberCache:
+    '''
+    Member profiles (hashed password and avatar path included) as Redis hashes, written through by every save.
+    A login by username is 1 round trip: a server-side script follows the username key to the hash.
+    A miss is filled only while the hash is still absent, so a save written through meanwhile is not overwritten.
+    Cache writes never fail the caller: errors are logged.
+    '''
+
+    _BY_USERNAME = '''
+local id = redis.call('GET', KEYS[1])
+if not id then
+    return nil
+end
+redis.call('EXPIRE', ARGV[1] .. id, ARGV[2])
+return redis.call('HGETALL', ARGV[1] .. id)
+'''
+
+    _FILL = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[1])
+'''
+
+    def __init__(self, redis):
+        self.redis = redis
+        self._byUsername = redis.register_script(MemberCache._BY_USERNAME)
+        self._fill = redis.register_script(MemberCache._FILL)
+
+    @staticmethod
+    def _mapping(dat: dict) -> dict:
+        '''
+        The fields dat has, a hash missing some is never read back (see getByUsername)
+        '''
+        return {f: dat[f].isoformat() if isinstance(dat[f], datetime) else str(dat[f]) for f in CACHE.MEMBER_FIELDS if dat.get(f) is not None}
+
+    def getByUsername(self, username: str) -> dict:
+        '''
+        The cached profile, None on a miss (or if Redis fails)
+        '''
+        try:
+            res = self._byUsername(keys=[CACHE.MEMBER_BY_USERNAME % username], args=[CACHE.MEMBER % '', CACHE.MEMBER_TTL])
+        except Exception as e:
+            logging.warning('[Redis] member cache unavailable: %r' % e)
+            return None
+        if not res:
+            return None
+        dat = {}
+        for i in range(0, len(res), 2):
+            dat[res[i].decode('UTF-8')] = res[i + 1].decode('UTF-8')
+        if len(dat) < len(CACHE.MEMBER_FIELDS) or dat['username'] != username: # partially expired or renamed meanwhile, reload it
+            return None
+        dat['birth'] = datetime.fromisoformat(dat['birth'])
+        return dat
+
+    def put(self, dat: dict) -> None:
+        '''
+        Store or overwrite the profile of dat['id'], moving its username key if the username changed
+        '''
+        key = CACHE.MEMBER % dat['id']
+        try:
+            mapping = MemberCache._mapping(dat)
+            old = self.redis.hget(key, 'username')
+            pipe = self.redis.pipeline(transaction=True)
+            if old is not None and old.decode('UTF-8') != dat['username']:
+                pipe.delete(CACHE.MEMBER_BY_USERNAME % old.decode('UTF-8'))
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, CACHE.MEMBER_TTL)
+            pipe.set(CACHE.MEMBER_BY_USERNAME % dat['username'], dat['id'], ex=CACHE.MEMBER_TTL)
+            pipe.execute()
+        except Exception as e:
+            logging.warning('[Redis] member cache unavailable: %r' % e)
+            self.forget(dat['id'])
+
+    def fill(self, dat: dict) -> None:
+        '''
+        Cache a profile just read from MongoDB, unless a save cached a newer one meanwhile
+        '''
+        try:
+            mapping = MemberCache._mapping(dat)
+            if len(mapping) < len(CACHE.MEMBER_FIELDS):
+                return # incomplete, it would never be read back
+            args = [CACHE.MEMBER_TTL, dat['id']]
+            for f in mapping:
+                args.extend([f, mapping[f]])
+            self._fill(keys=[CACHE.MEMBER % dat['id'], CACHE.MEMBER_BY_USERNAME % dat['username']], args=args)
+        except Exception as e:
+            logging.warning('[Redis] member cache unavailable: %r' % e)
+
+    def clear(self) -> None:
+        '''
+        Drop every cached profile, e.g. when the members were recreated
+        '''
+        try:
+            keys = []
+            for key in self.redis.scan_iter(match=CACHE.MEMBER % '*', count=1000):
+                keys.append(key)
+                if len(keys) == 1000:
+                    self.redis.delete(*keys)
+                    keys = []
+            if len(keys) > 0:
+                self.redis.delete(*keys)
+        except Exception as e:
+            logging.warning('[Redis] member cache could not be cleared: %r' % e)
+
+    def forget(self, mid: str) -> None:
+        try:
+            self.redis.delete(CACHE.MEMBER % mid) # the username key then leads nowhere, which is a miss
+        except Exception as e:
+            logging.warning('[Redis] member cache could not be cleared: %r' % e)
@@ -122,6 +122,7 @@ CREATE (hcm:Location:Province:City {name: 'TP. Hồ Chí Minh'}),
 (e43)-[:IS]->(j4), (e43)-[:IN]->(dh), (e43)-[:WORKS_AT]->(bh);
 
 CREATE INDEX IF NOT EXISTS FOR (n:Employee) ON (n.id);
+CREATE INDEX IF NOT EXISTS FOR (n:Employee) ON (n.name);
 CREATE INDEX IF NOT EXISTS FOR (j:JobTitle) ON (j.name);
 CREATE INDEX IF NOT EXISTS FOR (b:Branch) ON (b.name);
 CREATE INDEX IF NOT EXISTS FOR (d:Department) ON (d.name);
\ No newline at end of file
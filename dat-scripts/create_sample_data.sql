@@ -22,6 +22,12 @@ CREATE TABLE Product (
     CONSTRAINT FK_ProductType FOREIGN KEY (PType) REFERENCES ProductType(ID) ON DELETE SET NULL ON UPDATE CASCADE
 );
 
+-- For the paged catalogue queries (ID is implicitly the last part of each)
+CREATE INDEX IX_Product_Price ON Product (Price);
+CREATE INDEX IX_Product_PType_Price ON Product (PType, Price);
+CREATE INDEX IX_Product_PType_PName ON Product (PType, PName);
+CREATE INDEX IX_Product_OnSaleFrom ON Product (OnSaleFrom);
+
 INSERT INTO
     ProductType(ID, BriefName, ExtraDescription)
 VALUES
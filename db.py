@@ -3,13 +3,25 @@ Interacting with DBMSs.
 '''
 
 import json
+import logging
+import time
+import threading
+from os.path import isfile
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import mysql.connector
+from mysql.connector.constants import ClientFlag
 from neo4j import GraphDatabase
-from redis import Redis
+from redis import Redis, BlockingConnectionPool
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from hashlib import sha256
 
-from sample_data import SampleData, DB_NAME
+from sample_data import SampleData, DB_NAME, ensureMongoIndexes
+from pool import POOL, MySQLPool
+from instrument import timed, measure
+from cache import CACHE, ProductCache, MemberCache
+from avatars import AvatarStore, isRef
+from feed import FEED, ChangeFeed
 
 class LOGIN_RESULT:
     SUCC = 'successful'
@@ -20,6 +32,190 @@ class AVATAR:
     FOLDER = 'assets/avatars/'
     DEFAULT = FOLDER + 'default.png'
 
+class CONNECT:
+    BACKENDS = ['mysql', 'neo4j', 'redis', 'mongo']
+    TIMEOUT = 10 # seconds, per DBMS, can be overridden by a 'timeout' entry in its credentials
+
+class ConnectStatus:
+    def __init__(self, backend: str, ok: bool, elapsed: float, error: Exception = None):
+        self.backend = backend
+        self.ok = ok
+        self.elapsed = elapsed
+        self.error = error
+
+    def __str__(self):
+        if self.ok:
+            return '%s: connected in %.0f ms' % (self.backend, self.elapsed * 1000)
+        return '%s: FAILED after %.0f ms (%s)' % (self.backend, self.elapsed * 1000, self.error)
+
+class LOOKUP:
+    TTL = 300 # seconds, reference data rarely changes
+    JOBS = 'jobs'
+    DEPARTMENTS = 'deps'
+    BRANCHES = 'branches'
+
+class ProductRepository:
+    '''
+    Product CRUD on MySQL: server-side prepared statements for single rows, 1 statement or 1 transaction for bulk ones.
+    Pooled connections are in autocommit mode, so every write commits exactly once.
+    '''
+
+    _UPDATE = 'UPDATE Product SET PName = %s, OnSale = %s, OnSaleFrom = %s, Price = %s, PType = %s WHERE ID = %s' # never an upsert: PName is unique too
+    _INSERT = 'INSERT INTO Product(PName, OnSale, OnSaleFrom, Price, PType) VALUES (%s, %s, %s, %s, %s)'
+    _DELETE = 'DELETE FROM Product WHERE ID = %s'
+    _DELETE_MANY = 'DELETE FROM Product WHERE ID IN (%s)'
+
+    def __init__(self, pool: MySQLPool):
+        self.pool = pool
+        self._typeIDs = None
+        self._lock = threading.Lock()
+
+    def invalidateTypes(self) -> None:
+        self._typeIDs = None
+
+    def _getTypeIDs(self, reload=False) -> dict:
+        with self._lock:
+            if self._typeIDs is None or reload:
+                with self.pool.connection() as cnx:
+                    cur = cnx.cursor()
+                    cur.execute('SELECT t.ID, t.BriefName FROM ProductType AS t ORDER BY t.ID ASC;')
+                    self._typeIDs = {name: tid for tid, name in cur.fetchall()}
+                    cur.close()
+            return self._typeIDs
+
+    def getTypeID(self, ptype: str) -> int:
+        ids = self._getTypeIDs()
+        if ptype not in ids: # may have been added by someone else
+            ids = self._getTypeIDs(reload=True)
+        return ids[ptype]
+
+    def getTypes(self) -> list:
+        return list(self._getTypeIDs())
+
+    def getAll(self) -> list:
+        with self.pool.connection() as cnx:
+            cur = cnx.cursor()
+            cur.execute('SELECT p.ID, p.PName, p.OnSale, p.OnSaleFrom, p.Price, t.BriefName FROM Product AS p JOIN ProductType as t ON p.PType = t.ID ORDER BY p.ID ASC;')
+            res = cur.fetchall()
+            cur.close()
+            return res
+
+    _SORT_COLUMNS = {'id': 'p.ID', 'name': 'p.PName', 'on': 'p.OnSale', 'from': 'p.OnSaleFrom', 'price': 'p.Price', 'type': 't.BriefName'}
+    _INDEXES = {'IX_Product_Price': '(Price)', 'IX_Product_PType_Price': '(PType, Price)', 'IX_Product_PType_PName': '(PType, PName)', 'IX_Product_OnSaleFrom': '(OnSaleFrom)'} # ID is implicitly the last part of each
+
+    def ensureIndexes(self) -> None:
+        '''
+        Databases created before the paged queries miss their indexes
+        '''
+        with self.pool.connection() as cnx:
+            cur = cnx.cursor()
+            cur.execute('SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = \'Product\'')
+            existing = set(i[0] for i in cur.fetchall())
+            for name in ProductRepository._INDEXES:
+                if name not in existing:
+                    cur.execute('CREATE INDEX %s ON Product %s' % (name, ProductRepository._INDEXES[name]))
+            cur.close()
+
+    def getPage(self, ptype: str = None, sortKey: str = 'id', ascending: bool = True, after: tuple = None, limit: int = 200) -> tuple:
+        '''
+        1 page of products in (sortKey, ID) order, optionally of 1 type only.
+        after is the cursor returned with the previous page (None for the first one).
+        Returns (rows, cursor of the next page or None when this is the last one).
+        NULL keys sort as in MySQL: first when ascending, last when descending.
+        '''
+        col = ProductRepository._SORT_COLUMNS[sortKey]
+        op, direction = ('>', 'ASC') if ascending else ('<', 'DESC')
+        conditions = []
+        params = []
+        if ptype is not None:
+            conditions.append('p.PType = %s')
+            params.append(self.getTypeID(ptype))
+        if after is not None:
+            if sortKey == 'id':
+                conditions.append('p.ID %s %%s' % op)
+                params.append(after[1])
+            elif after[0] is None: # a row comparison with NULL is never true, the NULL rows need their own branches
+                conditions.append('((%s IS NULL AND p.ID %s %%s)%s)' % (col, op, ' OR %s IS NOT NULL' % col if ascending else ''))
+                params.append(after[1])
+            else:
+                conditions.append('((%s, p.ID) %s (%%s, %%s)%s)' % (col, op, '' if ascending else ' OR %s IS NULL' % col))
+                params.extend(after)
+        where = '' if len(conditions) == 0 else 'WHERE ' + ' AND '.join(conditions) + ' '
+        orderBy = 'p.ID %s' % direction if sortKey == 'id' else '%s %s, p.ID %s' % (col, direction, direction)
+        sql = ('SELECT p.ID, p.PName, p.OnSale, p.OnSaleFrom, p.Price, t.BriefName FROM Product AS p JOIN ProductType AS t ON p.PType = t.ID '
+               + where + 'ORDER BY ' + orderBy + ' LIMIT %s')
+        params.append(limit)
+
+        with self.pool.connection() as cnx:
+            cur = cnx.prepared(sql) # a handful of shapes only, each prepared once per connection
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+
+        if len(rows) < limit:
+            return rows, None
+        last = rows[-1]
+        key = {'id': last[0], 'name': last[1], 'on': last[2], 'from': last[3], 'price': last[4], 'type': last[5]}[sortKey]
+        return rows, (key, last[0])
+
+    def create(self, name, on, sfrom, price, ptype) -> int:
+        '''
+        The ID comes from AUTO_INCREMENT: no lock, no extra round trip, and concurrent creators never collide
+        '''
+        row = (name, int(on), sfrom, price, self.getTypeID(ptype))
+        with self.pool.connection() as cnx:
+            cur = cnx.prepared(ProductRepository._INSERT)
+            cur.execute(ProductRepository._INSERT, row)
+            return cur.lastrowid
+
+    def _row(self, pid, name, on, sfrom, price, ptype) -> tuple:
+        return (name, int(on), sfrom, price, self.getTypeID(ptype), int(pid))
+
+    def change(self, pid, name, on, sfrom, price, ptype) -> int:
+        '''
+        Returns the number of products found: 0 if it was deleted meanwhile, it is not recreated
+        '''
+        row = self._row(pid, name, on, sfrom, price, ptype)
+        with self.pool.connection() as cnx:
+            cur = cnx.prepared(ProductRepository._UPDATE)
+            cur.execute(ProductRepository._UPDATE, row)
+            return cur.rowcount
+
+    def changeMany(self, rows: list) -> int:
+        '''
+        rows: list of (pid, name, on, sfrom, price, ptype). Returns the number of products found, the deleted ones are skipped.
+        '''
+        if len(rows) == 0:
+            return 0
+        rows = [self._row(*r) for r in rows]
+        with self.pool.connection() as cnx, cnx.transaction():
+            cur = cnx.cursor()
+            cur.executemany(ProductRepository._UPDATE, rows) # 1 UPDATE per row, all or none of them committed
+            count = cur.rowcount
+            cur.close()
+            return count
+
+    def existing(self, pids: list) -> set:
+        if len(pids) == 0:
+            return set()
+        with self.pool.connection() as cnx:
+            cur = cnx.cursor()
+            cur.execute('SELECT p.ID FROM Product AS p WHERE p.ID IN (%s)' % ', '.join(['%s'] * len(pids)), [int(p) for p in pids])
+            res = set(r[0] for r in cur.fetchall())
+            cur.close()
+            return res
+
+    def delete(self, pid) -> None:
+        with self.pool.connection() as cnx:
+            cnx.prepared(ProductRepository._DELETE).execute(ProductRepository._DELETE, (int(pid),))
+
+    def deleteMany(self, pids: list) -> None:
+        if len(pids) == 0:
+            return
+        with self.pool.connection() as cnx:
+            cur = cnx.cursor()
+            cur.execute(ProductRepository._DELETE_MANY % ', '.join(['%s'] * len(pids)), [int(p) for p in pids])
+            cur.close()
+
 class Wrapper:
     '''
     Should manually catch exception from any db operation when using this class!
@@ -31,151 +227,409 @@ class Wrapper:
         self.redis = None
         self.mongo = self.mongoDb = None
         self.connected = False
+        self.connectStatus = {}
         self.sampleData = None
+        self.mysqlPool = None
+        self.products = None
+        self.productCache = None
+        self.memberCache = None
+        self.avatars = None
+        self.feed = None
+        self._lookups = None
+        self._lookupsLoadedAt = 0
+        self._lookupsLock = threading.Lock()
         pass
 
-    def connect(self, credentials_path: str) -> None:
+    @staticmethod
+    def _poolSize(info: dict) -> int:
+        return int(info.get('pool_size', POOL.SIZE))
+
+    @staticmethod
+    def _open(backend: str, info: dict, timeout: float):
+        '''
+        Open and probe 1 DBMS, returning its handle(s). Runs on a worker thread, must not touch self.
+        '''
+        if backend == 'mysql':
+            cnx = mysql.connector.connect(user=info['acc'], password=info['pass'], connection_timeout=int(timeout))
+            return cnx, cnx.cursor()
+
+        if backend == 'neo4j':
+            driver = GraphDatabase.driver(info['uri'], auth=(info['acc'], info['pass']), connection_timeout=timeout, max_connection_pool_size=Wrapper._poolSize(info))
+            try:
+                sess = driver.session()
+                sess.run('RETURN 1').consume()
+            except:
+                driver.close()
+                raise
+            return driver, sess
+
+        if backend == 'redis': # Using Memurai 
+            pool = BlockingConnectionPool(host=info['host'], port=info['port'], db=0, socket_connect_timeout=timeout, max_connections=Wrapper._poolSize(info), timeout=POOL.WAIT)
+            redis = Redis(connection_pool=pool)
+            redis.ping()
+            return redis
+
+        if backend == 'mongo': 
+            mongo = MongoClient(info['uri'], serverSelectionTimeoutMS=int(timeout * 1000), maxPoolSize=Wrapper._poolSize(info))
+            try:
+                mongo.admin.command('ping')
+            except:
+                mongo.close()
+                raise
+            return mongo
+
+    @staticmethod
+    def _close(backend: str, handle) -> None:
+        try:
+            if backend == 'mysql' or backend == 'neo4j':
+                handle[0].close()
+            elif backend == 'mongo':
+                handle.close()
+            elif backend == 'redis':
+                handle.connection_pool.disconnect()
+        except:
+            pass # ignore
+
+    @staticmethod
+    def _closeLate(backend: str, future) -> None:
+        '''
+        A connection abandoned by its timeout but opened afterwards would leak: close it
+        '''
+        if not future.cancelled() and future.exception() is None:
+            Wrapper._close(backend, future.result())
+
+    def connect(self, credentials_path: str) -> dict:
+        '''
+        Connect to all DBMSs concurrently, each one bounded by its own timeout.
+        Returns {backend: ConnectStatus}, raises if any of them failed (the others are closed again).
+        '''
         with open(credentials_path, 'r') as f:
             credentials = json.load(f)
 
-            for i in ['mysql', 'neo4j', 'redis', 'mongo']:
-                info = credentials[i]
-
-                if i == 'mysql':
-                    self.mysql = mysql.connector.connect(user=info['acc'], password=info['pass'])
-                    self.mysqlCur = self.mysql.cursor()
-
-                if i == 'neo4j':
-                    self.neo4j = GraphDatabase.driver(info['uri'], auth=(info['acc'], info['pass']))
-                    self.neo4jSess = self.neo4j.session()
-
-                if i == 'redis': # Using Memurai 
-                    self.redis = Redis(host=info['host'], port=info['port'], db=0)
-
-                if i == 'mongo': 
-                    self.mongo = MongoClient(info['uri'])
+        executor = ThreadPoolExecutor(max_workers=len(CONNECT.BACKENDS))
+        start = time.monotonic()
+        futures = {}
+        for i in CONNECT.BACKENDS:
+            info = credentials[i]
+            futures[i] = executor.submit(Wrapper._open, i, info, info.get('timeout', CONNECT.TIMEOUT))
+        executor.shutdown(wait=False) # a hung backend must not hold up the others
+
+        handles = {}
+        status = {}
+        for i in CONNECT.BACKENDS:
+            timeout = credentials[i].get('timeout', CONNECT.TIMEOUT)
+            try:
+                handles[i] = futures[i].result(timeout=max(0, start + timeout - time.monotonic()))
+                status[i] = ConnectStatus(i, True, time.monotonic() - start)
+            except FutureTimeoutError:
+                status[i] = ConnectStatus(i, False, time.monotonic() - start, TimeoutError('timed out'))
+                futures[i].add_done_callback(lambda f, backend=i: Wrapper._closeLate(backend, f)) # at once if it just finished
+            except Exception as e:
+                status[i] = ConnectStatus(i, False, time.monotonic() - start, e)
+        self.connectStatus = status
+
+        failed = [str(status[i]) for i in CONNECT.BACKENDS if not status[i].ok]
+        if len(failed) > 0:
+            for i in handles:
+                Wrapper._close(i, handles[i])
+            raise ConnectionError('Unable to connect to all DBMSs: ' + '; '.join(failed))
+
+        # These single connection/session are only for SampleData, the rest goes through the pools
+        self.mysql, self.mysqlCur = handles['mysql']
+        self.neo4j, self.neo4jSess = handles['neo4j']
+        self.redis = handles['redis']
+        self.mongo = handles['mongo']
 
         self.connected = True
-        self.sampleData = SampleData(self.mysqlCur, self.neo4jSess, self.mongo, self.redis, credentials)
+        self.sampleData = SampleData(self.mysqlCur, self.neo4jSess, self.mongo, self.redis, credentials, self.neo4j)
         self.credentials = credentials   
+        return status
 
     def disconnect(self) -> None:
         try:
             if self.connected:
-                self.mysql.close()
-                self.neo4j.close()
-                self.mongo.close()
-                # Redis (Memurai) handles the connection itself, no need to close manually
+                Wrapper._close('mysql', (self.mysql, self.mysqlCur))
+                Wrapper._close('neo4j', (self.neo4j, self.neo4jSess))
+                Wrapper._close('mongo', self.mongo)
+                Wrapper._close('redis', self.redis)
+                if self.mysqlPool is not None:
+                    self.mysqlPool.close()
                 self.mysql = self.mysqlCur = self.neo4j = self.neo4jSess = self.redis = self.mongo = None
                 self.sampleData = None
+                self.mysqlPool = None
+                self.products = self.productCache = self.memberCache = self.avatars = self.feed = None
                 self.connected = False
+                self.invalidateLookups()
         except:
             pass # ignore
 
-    def createSampleData(self) -> None:
-        self.sampleData.createAll()    
+    @timed('all')
+    def createSampleData(self, backends: list = None, progress=None) -> dict:
+        '''
+        Seed all (or the given) DBMSs concurrently, raises once all of them are done if any failed
+        '''
+        data = self.sampleData
+        statuses = data.createAll(progress) if backends is None else data.create(backends, progress)
         self.mysql.commit()
-
+        if self.mysqlPool is not None and (backends is None or 'mysql' in backends):
+            self._openMySQLPool() # the seed script drops the database: the pooled connections lost it, their statements too
+        self.invalidateLookups()
+        if self.products is not None:
+            self.products.invalidateTypes()
+        ProductCache(self.redis, self.products).invalidate() # the cached catalogue may be of the replaced database
+        if backends is None or 'mongo' in backends:
+            MemberCache(self.redis).clear()
+
+        failed = [i for i in statuses if not statuses[i].ok]
+        if len(failed) > 0:
+            raise RuntimeError('Could not create sample data for %s:\n%s' % (', '.join(failed), '\n'.join(str(statuses[i]) for i in statuses)))
+        return statuses
+
+    @timed('all')
     def pickupDatabase(self) -> None:
         self.mysql.database = DB_NAME.UNDERSCORE_VERSION
-        self.neo4jSess = self.neo4j.session(database=DB_NAME.CAMEL_VERSION)
+        self._openMySQLPool()
+        self.products.ensureIndexes()
+        self._ensureEmployeeIndexes()
         self.mongoDb = self.mongo[DB_NAME.UNDERSCORE_VERSION]
+        self._ensureMemberIndexes()
+        self.memberCache = MemberCache(self.redis)
+        self.avatars = AvatarStore(self.redis, self.mongoDb)
+        self.feed = ChangeFeed(self.redis)
         # No need to select database for Redis
-
+        self.invalidateLookups()
+
+    def _openMySQLPool(self) -> None:
+        '''
+        A new pool (and the product repository on it) replaces the current one, whose connections are closed
+        '''
+        if self.mysqlPool is not None:
+            self.mysqlPool.close()
+        info = self.credentials['mysql']
+        self.mysqlPool = MySQLPool(Wrapper._poolSize(info), user=info['acc'], password=info['pass'], database=DB_NAME.UNDERSCORE_VERSION, connection_timeout=int(info.get('timeout', CONNECT.TIMEOUT)),
+                                   client_flags=[ClientFlag.FOUND_ROWS]) # UPDATE counts the rows found, not only the changed ones
+        self.products = ProductRepository(self.mysqlPool)
+        self.productCache = ProductCache(self.redis, self.products)
+
+    def _session(self):
+        '''
+        A Neo4j session for 1 unit of work, drawn from the driver's pool. Use it with "with".
+        '''
+        return self.neo4j.session(database=DB_NAME.CAMEL_VERSION)
+
+    _EMP_INDEXES = ['CREATE INDEX IF NOT EXISTS FOR (n:Employee) ON (n.id)', 'CREATE INDEX IF NOT EXISTS FOR (n:Employee) ON (n.name)', 'CREATE INDEX IF NOT EXISTS FOR (b:Branch) ON (b.name)', 'CREATE INDEX IF NOT EXISTS FOR (d:Department) ON (d.name)', 'CREATE INDEX IF NOT EXISTS FOR (j:JobTitle) ON (j.name)']
+    _EMP_SORT = {'id': 'n.id', 'name': 'n.name', 'birth': 'n.birth', 'male': 'toString(n.male)', 'job': 'j.name', 'dep': 'd.name', 'branch': 'b.name'} # male: older edits stored it as a string
+
+    @timed('neo4j', 'ensureIndexes')
+    def _ensureEmployeeIndexes(self) -> None:
+        '''
+        Graphs created before the paged queries miss the Employee.name index
+        '''
+        with self._session() as neo4jSess:
+            for stmt in Wrapper._EMP_INDEXES:
+                neo4jSess.run(stmt).consume()
+
+    @timed('neo4j')
+    def getEmployeePage(self, branch: str = None, department: str = None, job: str = None, sortKey: str = 'name', ascending: bool = True, after: tuple = None, limit: int = 200) -> tuple:
+        '''
+        1 page of employees in (sortKey, id) order, optionally of 1 branch / department / job title only.
+        Rows are (id, name, birth, male, job, dep, branch). Works like ProductRepository.getPage.
+        '''
+        col = Wrapper._EMP_SORT[sortKey]
+        op, direction = ('>', 'ASC') if ascending else ('<', 'DESC')
+        # Filters go into the patterns so that the planner starts from the indexed name lookup
+        query = ('MATCH (n:Employee)-[:WORKS_AT]->(b:Branch%s), (n)-[:IN]->(d:Department%s), (n)-[:IS]->(j:JobTitle%s) '
+                 % ('' if branch is None else ' {name: $branch}', '' if department is None else ' {name: $dep}', '' if job is None else ' {name: $job}'))
+        params = {'branch': branch, 'dep': department, 'job': job, 'limit': limit}
+        if after is not None:
+            if sortKey == 'id':
+                query += 'WHERE n.id %s $afterId ' % op
+            else:
+                query += 'WHERE %s %s $afterKey OR (%s = $afterKey AND n.id %s $afterId) ' % (col, op, col, op)
+            params['afterKey'], params['afterId'] = after
+        query += 'RETURN n.id AS id, n.name AS name, n.birth AS birth, n.male AS male, j.name AS job, d.name AS dep, b.name AS branch '
+        query += ('ORDER BY n.id %s' % direction if sortKey == 'id' else 'ORDER BY %s %s, n.id %s' % (col, direction, direction)) + ' LIMIT $limit'
+
+        with self._session() as neo4jSess:
+            rows = [tuple(r.values()) for r in neo4jSess.run(query, params)]
+
+        if len(rows) < limit:
+            return rows, None
+        last = rows[-1]
+        key = {'id': last[0], 'name': last[1], 'birth': last[2], 'male': str(last[3]).lower(), 'job': last[4], 'dep': last[5], 'branch': last[6]}[sortKey]
+        return rows, (key, last[0])
+
+    @timed('neo4j')
     def getEmployees(self) -> list:
-        neo4jSess = self.neo4jSess
-        res = neo4jSess.run('MATCH (n:Employee)-[:IS]->(j), (n)-[:IN]->(d), (n)-[:WORKS_AT]->(b) RETURN n, j, d, b')
-        return res.data()
+        with self._session() as neo4jSess:
+            res = neo4jSess.run('MATCH (n:Employee)-[:IS]->(j), (n)-[:IN]->(d), (n)-[:WORKS_AT]->(b) RETURN n, j, d, b')
+            return res.data()
+
+    @timed('neo4j', 'getLookups', rows=lambda res: sum(len(v) for v in res.values()))
+    def _getLookups(self) -> dict:
+        '''
+        Job titles, departments and branches, shared by all HR windows and fetched in 1 query per connection (or per TTL)
+        '''
+        with self._lookupsLock:
+            if self._lookups is None or time.monotonic() - self._lookupsLoadedAt > LOOKUP.TTL:
+                with self._session() as neo4jSess:
+                    res = neo4jSess.run('OPTIONAL MATCH (j:JobTitle) WITH collect(j.name) AS jobs '
+                                        'OPTIONAL MATCH (d:Department) WITH jobs, collect(d.name) AS deps '
+                                        'OPTIONAL MATCH (b:Branch) RETURN jobs, deps, collect(b.name) AS branches')
+                    self._lookups = res.single().data()
+                self._lookupsLoadedAt = time.monotonic()
+            return self._lookups
+
+    def invalidateLookups(self) -> None:
+        self._lookups = None
 
     def getJobs(self) -> list:
-        neo4jSess = self.neo4jSess
-        res = neo4jSess.run('MATCH (j:JobTitle) RETURN j')
-        jobs = []
-        for j in res.data():
-            jobs.append(j['j']['name'])
-        return jobs
+        return list(self._getLookups()[LOOKUP.JOBS])
 
     def getBranches(self) -> list:
-        neo4jSess = self.neo4jSess
-        res = neo4jSess.run('MATCH (b:Branch) RETURN b')
-        branches = []
-        for b in res.data():
-            branches.append(b['b']['name'])
-        return branches
+        return list(self._getLookups()[LOOKUP.BRANCHES])
 
     def getDepartments(self) -> list:
-        neo4jSess = self.neo4jSess
-        res = neo4jSess.run('MATCH (d:Department) RETURN d')
-        deps = []
-        for d in res.data():
-            deps.append(d['d']['name'])
-        return deps
+        return list(self._getLookups()[LOOKUP.DEPARTMENTS])
+
+    _UPSERT_EMPS = ('UNWIND $rows AS row '
+                    'MATCH (j:JobTitle {name: row.job}), (d:Department {name: row.dep}), (b:Branch {name: row.branch}) '
+                    'MERGE (n:Employee {id: row.id}) '
+                    'SET n.name = row.name, n.birth = date(row.birth), n.male = row.male '
+                    'WITH n, j, d, b '
+                    'OPTIONAL MATCH (n)-[r:IS|IN|WORKS_AT]->() '
+                    'DELETE r '
+                    'WITH DISTINCT n, j, d, b '
+                    'CREATE (n)-[:IS]->(j), (n)-[:IN]->(d), (n)-[:WORKS_AT]->(b)')
+
+    @staticmethod
+    def _empRow(eid, name, birth, male, job, dep, branch) -> dict:
+        return {'id': eid, 'name': name, 'birth': birth, 'male': male, 'job': job, 'dep': dep, 'branch': branch}
+
+    def _published(self, op: str, topic: str, changes: list, products: bool = False) -> None:
+        '''
+        The Redis side of a write, recorded apart from its DB call: invalidating the product cache, publishing the change
+        '''
+        def notify():
+            if products:
+                self.productCache.invalidate() # only once committed, see ProductCache
+            self.feed.publish(topic, changes)
+
+        measure('redis', op, notify)
 
     def changeEmp(self, eid, name, birth, male, job, dep, branch) -> None:
-        neo4jSess = self.neo4jSess
-        res = neo4jSess.run('MATCH (n:Employee {id: \'%s\'}) RETURN n' % eid)
+        self._changeEmps('changeEmp', [Wrapper._empRow(eid, name, birth, male, job, dep, branch)])
 
-        if len(res.data()) == 0: # new emp
-            neo4jSess.run('CREATE (n:Employee {id: \'%s\'})' % eid)
-        else: # existing emp
-            neo4jSess.run('MATCH (n:Employee {id: \'%s\'})-[jr:IS]->(j), (n)-[dr:IN]->(d), (n)-[wr:WORKS_AT]->(b) DELETE jr, dr, wr' % eid)
+    def changeEmps(self, rows: list) -> None:
+        '''
+        Upsert many employees in 1 round trip, each row is a dict as built by _empRow.
+        The query text is constant so that Neo4j can reuse its plan.
+        '''
+        self._changeEmps('changeEmps', rows)
 
-        neo4jSess.run('MATCH (n:Employee {id: \'%s\'}), (j:JobTitle {name: \'%s\'}), (d:Department {name: \'%s\'}), (b:Branch {name: \'%s\'}) SET n.name=\'%s\', n.birth=date(\'%s\'), n.male=\'%s\' WITH n, j, d, b CREATE (n)-[:IS]->(j), (n)-[:IN]->(d), (n)-[:WORKS_AT]->(b)' % (eid, job, dep, branch, name, birth, male)) 
+    def _changeEmps(self, op: str, rows: list) -> None:
+        measure('neo4j', op, self._upsertEmps, rows)
+        self._published(op, FEED.EMPLOYEES, [(FEED.UPSERT, r['id'], [r['id'], r['name'], r['birth'], r['male'], r['job'], r['dep'], r['branch']]) for r in rows])
+
+    def _upsertEmps(self, rows: list) -> None:
+        with self._session() as neo4jSess:
+            neo4jSess.write_transaction(lambda tx: tx.run(Wrapper._UPSERT_EMPS, rows=rows).consume())
 
     def delEmp(self, eid: str) -> None:
-        self.neo4jSess.run('MATCH (n:Employee {id: \'%s\'}) DETACH DELETE n' % eid)
+        measure('neo4j', 'delEmp', self._deleteEmp, eid)
+        self._published('delEmp', FEED.EMPLOYEES, [(FEED.DELETE, eid, None)])
+
+    def _deleteEmp(self, eid: str) -> None:
+        with self._session() as neo4jSess:
+            neo4jSess.run('MATCH (n:Employee {id: $id}) DETACH DELETE n', id=eid).consume()
+
+    # the product reads are recorded by ProductCache, the cache lookup under redis and a miss under mysql
 
     def getProducts(self):
-        mysqlCur = self.mysqlCur
-        mysqlCur.execute('SELECT p.ID, p.PName, p.OnSale, p.OnSaleFrom, p.Price, t.BriefName FROM Product AS p JOIN ProductType as t ON p.PType = t.ID ORDER BY p.ID ASC;')
-        return mysqlCur.fetchall()
+        return self.productCache.getAll()
+
+    def getProductPage(self, ptype: str = None, sortKey: str = 'id', ascending: bool = True, after: tuple = None, limit: int = 200) -> tuple:
+        return self.productCache.getPage(ptype, sortKey, ascending, after, limit)
 
     def getProductTypes(self) -> list:
-        mysqlCur = self.mysqlCur
-        mysqlCur.execute('SELECT t.Briefname FROM ProductType AS t;')
-        res = mysqlCur.fetchall()
-        ts = [t[0] for t in res]
-        return ts
-
-    def getNewProdID(self) -> int:
-        mysqlCur = self.mysqlCur
-        mysqlCur.execute('SELECT max(p.ID) FROM Product as p')
-        res = mysqlCur.fetchall()[0][0]
-        return res + 1
-
-    def changeProd(self, pid, name, on, sfrom, price, ptype) -> None:
-        mysqlCur = self.mysqlCur
-
-        mysqlCur.execute('SELECT t.ID FROM ProductType AS t WHERE t.BriefName = \'%s\'' % ptype)
-        t = mysqlCur.fetchall()[0][0]
-
-        mysqlCur.execute('SELECT p.ID FROM Product AS p WHERE p.ID = %s' % pid)
-        if len(mysqlCur.fetchall()) == 0:
-            mysqlCur.execute('INSERT INTO Product(ID, PName, OnSale, OnSaleFrom, Price, PType) VALUES (%s, \'%s\', %d, \'%s\', %s, %d)' % (pid, name, on, sfrom, price, t))
-        else:
-            mysqlCur.execute('UPDATE Product SET PName=\'%s\', OnSale=%d, OnSaleFrom=\'%s\', Price=%s, PType=%d WHERE ID = %s' % (name, on, sfrom, price, t, pid))
-        self.mysql.commit()
+        return self.productCache.getTypes()
+
+    def createProd(self, name, on, sfrom, price, ptype) -> int:
+        pid = measure('mysql', 'createProd', self.products.create, name, on, sfrom, price, ptype)
+        self._published('createProd', FEED.PRODUCTS, [(FEED.UPSERT, pid, [pid, name, on, sfrom, price, ptype])], products=True)
+        return pid
+
+    def changeProd(self, pid, name, on, sfrom, price, ptype) -> int:
+        '''
+        Returns 0 if the product no longer exists
+        '''
+        found = measure('mysql', 'changeProd', self.products.change, pid, name, on, sfrom, price, ptype)
+        if found > 0:
+            self._published('changeProd', FEED.PRODUCTS, [(FEED.UPSERT, pid, [pid, name, on, sfrom, price, ptype])], products=True)
+        return found
+
+    def changeProds(self, rows: list) -> int:
+        '''
+        Returns the number of products found, the deleted ones are not recreated
+        '''
+        found, rows = measure('mysql', 'changeProds', self._changeProds, rows)
+        if found > 0:
+            self._published('changeProds', FEED.PRODUCTS, [(FEED.UPSERT, r[0], list(r)) for r in rows], products=True)
+        return found
+
+    def _changeProds(self, rows: list) -> tuple:
+        '''
+        -> (products found, the rows of those)
+        '''
+        found = self.products.changeMany(rows)
+        if 0 < found < len(rows): # rare: some were deleted meanwhile, they must not reappear elsewhere
+            existing = self.products.existing([r[0] for r in rows])
+            rows = [r for r in rows if int(r[0]) in existing]
+        return found, rows
 
     def delProd(self, pid: int) -> None:
-        mysqlCur = self.mysqlCur
-        mysqlCur.execute('DELETE FROM Product AS p WHERE p.ID = %s;' % pid)
-        self.mysql.commit()
+        measure('mysql', 'delProd', self.products.delete, pid)
+        self._published('delProd', FEED.PRODUCTS, [(FEED.DELETE, pid, None)], products=True)
 
-    def memLogin(self, acc: str, pw: str):
-        col = self.mongoDb['mems']
-        res = col.find({'username': acc})
+    def delProds(self, pids: list) -> None:
+        measure('mysql', 'delProds', self.products.deleteMany, pids)
+        self._published('delProds', FEED.PRODUCTS, [(FEED.DELETE, pid, None) for pid in pids], products=True)
 
-        if res.count() == 0:
-            return LOGIN_RESULT.NOT_FOUND, {}
-        
-        acc = res[0]
-        hashed = acc['password']
+    _MEM_PROJECTION = dict([(f, True) for f in CACHE.MEMBER_FIELDS if f != 'ava'] + [('_id', False)]) # what a login shows and caches
+
+    @timed('mongo', 'ensureIndexes')
+    def _ensureMemberIndexes(self) -> None:
+        '''
+        Databases created before the unique indexes scan the whole collection on every login
+        '''
+        try:
+            ensureMongoIndexes(self.mongoDb)
+        except OperationFailure as e: # duplicates saved before the indexes existed, logins still work without them
+            logging.warning('[MongoDB] members could not be indexed: %s' % e)
+
+    def memLogin(self, acc: str, pw: str):
+        '''
+        From the member cache when possible, the profile comes with its avatar path as 'ava'
+        '''
+        dat = measure('redis', 'memLogin', self.memberCache.getByUsername, acc)
+        if dat is None:
+            dat = measure('mongo', 'memLogin', self.mongoDb['mems'].find_one, {'username': acc}, Wrapper._MEM_PROJECTION)
+            if dat is None:
+                return LOGIN_RESULT.NOT_FOUND, {}
+            dat['ava'] = self.getMemAvatarPath(dat['id'])
+            measure('redis', 'memLogin:fill', self.memberCache.fill, dat)
+
+        hashed = dat['password']
         if hashed == sha256(bytes(pw, encoding='UTF-8')).hexdigest():
-            return LOGIN_RESULT.SUCC, acc
+            return LOGIN_RESULT.SUCC, dat
         
         return LOGIN_RESULT.WRONG, {}
 
+    @timed('redis')
     def getMemAvatarPath(self, uid: str) -> str:
+        '''
+        An avatar reference of the store (see avatars.py), or the path saved before it / of the sample data
+        '''
         redis = self.redis
         key = '%s-avatar_path' % uid
 
@@ -186,13 +640,38 @@ class Wrapper:
             path = path.decode('UTF-8')
         return path
 
-    def saveMemInfo(self, dat: dict) -> None:
-        redis = self.redis
-        col = self.mongoDb['mems']
+    @timed('redis', rows=None)
+    def getAvatar(self, ref: str, size: int) -> bytes:
+        return self.avatars.rendition(ref, size)
 
-        col.update_one({ 'id': dat['id'] }, { '$set': { 'id': dat['id'], 'username': dat['username'], 'password': dat['password'], 'level': dat['level'], 'fullname': dat['fullname'], 'birth': dat['birth'], 'phone': dat['phone'], 'email': dat['email'], 'address': dat['address'] } }, upsert=True)
-
-        redis.set('%s-avatar_path' % dat['id'], dat['ava'])
+    def saveMemInfo(self, dat: dict) -> str:
+        '''
+        A newly picked avatar file is ingested into the avatar store, returns the avatar reference saved
+        '''
+        col = self.mongoDb['mems']
+        if not isRef(dat['ava']) and isfile(dat['ava']):
+            dat['ava'] = self.avatars.ingest(dat['ava'])
+
+        measure('mongo', 'saveMemInfo', col.update_one, { 'id': dat['id'] }, { '$set': { 'id': dat['id'], 'username': dat['username'], 'password': dat['password'], 'level': dat['level'], 'fullname': dat['fullname'], 'birth': dat['birth'], 'phone': dat['phone'], 'email': dat['email'], 'address': dat['address'] } }, upsert=True)
+        measure('redis', 'saveMemInfo', self._memberSaved, dat)
+        return dat['ava']
+
+    def _memberSaved(self, dat: dict) -> None:
+        self.redis.set('%s-avatar_path' % dat['id'], dat['ava'])
+        self.memberCache.put(dat) # write-through, the next login sees this save
+        self.feed.publish(FEED.MEMBERS, [(FEED.UPSERT, dat['id'], None)]) # the id only, no profile (nor password hash) on the channel: see reloadMember
+
+    def reloadMember(self, mid: str) -> dict:
+        '''
+        The profile saved by another app instance, read again from MongoDB; None if the member is gone
+        '''
+        measure('redis', 'reloadMember', self.memberCache.forget, mid)
+        dat = measure('mongo', 'reloadMember', self.mongoDb['mems'].find_one, {'id': mid}, Wrapper._MEM_PROJECTION)
+        if dat is None:
+            return None
+        dat['ava'] = self.getMemAvatarPath(mid)
+        measure('redis', 'reloadMember:fill', self.memberCache.fill, dat)
+        return dat
 
     def __del__(self):
         self.disconnect()
\ No newline at end of file
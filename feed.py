@@ -0,0 +1,99 @@
+'''
+Change feed between app instances: every write is published on a Redis channel, the other instances patch their windows.
+'''
+
+import json
+import logging
+import threading
+from uuid import uuid4
+from PyQt5.QtCore import QObject, pyqtSignal
+
+class FEED:
+    CHANNEL = 'changes'
+    EMPLOYEES = 'employees'
+    PRODUCTS = 'products'
+    MEMBERS = 'members'
+    UPSERT = 'upsert' # kinds of models.CHANGE
+    DELETE = 'delete'
+    POLL = 0.5 # seconds a wait for messages may take, bounds how long stopping takes
+    RETRY = 2 # seconds before subscribing again after an error
+
+ORIGIN = uuid4().hex # this app instance, its own messages are not delivered back to it
+
+class ChangeFeed:
+    '''
+    publish(topic, changes) with changes as (kind, key, values), values JSON-able (dates as ISO strings).
+    1 message per write, however many rows it changed. Publishing never fails the write: errors are logged.
+    '''
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def publish(self, topic: str, changes: list) -> None:
+        if len(changes) == 0:
+            return
+        msg = json.dumps({'origin': ORIGIN, 'topic': topic, 'changes': [[kind, key, values] for kind, key, values in changes]}, default=str)
+        try:
+            self.redis.publish(FEED.CHANNEL, msg)
+        except Exception as e:
+            logging.warning('[Redis] change not published: %r' % e)
+
+class ChangeSubscriber(QObject):
+    '''
+    Listens on a background thread, received(topic, changes) is emitted on the GUI thread.
+    Reconnects after errors; changes missed meanwhile only show after a refresh.
+    '''
+
+    received = pyqtSignal(str, list)
+
+    def __init__(self):
+        super().__init__()
+        self._thread = None
+        self._stopped = None
+
+    def start(self, redis) -> None:
+        self.stop()
+        if redis is None:
+            return
+        stopped = self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(redis, stopped), name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''
+        Returns at once, the thread ends within FEED.POLL
+        '''
+        if self._stopped is not None:
+            self._stopped.set()
+        self._thread = self._stopped = None
+
+    def _run(self, redis, stopped: threading.Event) -> None:
+        while not stopped.is_set():
+            pubsub = None
+            try:
+                pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(FEED.CHANNEL)
+                while not stopped.is_set():
+                    msg = pubsub.get_message(timeout=FEED.POLL)
+                    if msg is not None and msg['type'] == 'message':
+                        self._dispatch(msg['data'])
+            except Exception as e:
+                if stopped.is_set():
+                    break # disconnected under us
+                logging.warning('[Redis] change feed interrupted: %r' % e)
+                stopped.wait(FEED.RETRY)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except:
+                        pass # ignore
+
+    def _dispatch(self, data: bytes) -> None:
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            return # ignore, not ours
+        if msg.get('origin') == ORIGIN:
+            return
+        self.received.emit(msg['topic'], msg['changes'])
@@ -0,0 +1,105 @@
+'''
+Numeric IDs unique across the app instances, leased from Redis in blocks and handed out from memory.
+'''
+
+import logging
+import threading
+from PyQt5.QtCore import QSettings
+
+class IDS:
+    KEY = 'ids:global' # Redis counter, the last ID leased by anyone
+    BLOCK = 100 # IDs per lease
+    SETTING = 'global.id' # local high-water mark in app.ini, used offline
+    REFILL = 10 # % of a block left when the next one is leased, on a worker thread
+    WAIT = 2 # seconds next() waits for a lease still in flight, then the local counter is used
+
+class IdService:
+    '''
+    next() costs a lock and an addition: leases (1 Redis round trip per IDS.BLOCK IDs) run ahead on the task runner,
+    so a stalled Redis never freezes the GUI thread for more than IDS.WAIT.
+    redis() -> the connected client or None. Without Redis, blocks come from the local high-water mark instead:
+    unique on this workstation only, and the Redis counter is raised above it at the next online lease.
+    IDs left in a block when the app exits are never used.
+    '''
+
+    _LEASE = '''
+local floor = tonumber(ARGV[2])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if current < floor then
+    redis.call('SET', KEYS[1], floor)
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+'''
+
+    def __init__(self, settings: QSettings, redis, tasks):
+        self.settings = settings
+        self.redis = redis
+        self.tasks = tasks
+        self._next = 0
+        self._end = 0 # exclusive
+        self._lease = None # the lease in flight or done: {'done': Event, 'last': last ID leased}
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        '''
+        Call it on the GUI thread, as the task runner
+        '''
+        with self._lock:
+            if self._next >= self._end:
+                self._nextBlock()
+            res = self._next
+            self._next += 1
+            if self._end - self._next <= IDS.BLOCK * IDS.REFILL // 100:
+                self._leaseAhead()
+            return res
+
+    def leaseAhead(self) -> None:
+        '''
+        Lease the next block now, e.g. once connected, so that the first next() does not wait for it
+        '''
+        with self._lock:
+            self._leaseAhead()
+
+    def _local(self) -> int:
+        return int(self.settings.value(IDS.SETTING, 0))
+
+    def _leaseAhead(self) -> None:
+        if self._lease is not None:
+            return
+        redis = self.redis()
+        if redis is None:
+            return
+        lease = self._lease = {'done': threading.Event()}
+        self.tasks.run('Leasing IDs', IdService._fetch, redis, self._local(), lease)
+
+    @staticmethod
+    def _fetch(redis, floor: int, lease: dict) -> None:
+        '''
+        Runs on a worker thread
+        '''
+        try:
+            lease['last'] = int(redis.eval(IdService._LEASE, 1, IDS.KEY, IDS.BLOCK, floor))
+        except Exception as e:
+            logging.warning('[Redis] cannot lease IDs, using the local counter: %r' % e)
+        finally:
+            lease['done'].set()
+
+    def _nextBlock(self) -> None:
+        self._leaseAhead() # none in flight yet: the first block, or Redis is back
+        last = None
+        lease = self._lease
+        if lease is not None:
+            if lease['done'].wait(IDS.WAIT):
+                self._lease = None
+                last = lease.get('last')
+                if last is not None and last - IDS.BLOCK < self._local(): # overlaps a block taken from the local counter meanwhile
+                    last = None
+            else:
+                logging.warning('[Redis] no IDs leased after %d seconds, using the local counter' % IDS.WAIT) # the lease stays in flight for the next block
+        if last is None:
+            last = self._local() + IDS.BLOCK
+
+        self._next = last - IDS.BLOCK + 1
+        self._end = last + 1
+        self.settings.setValue(IDS.SETTING, last) # 1 write per block, so the offline counter never goes back
+        self.settings.sync()
@@ -0,0 +1,188 @@
+'''
+Timing of the DB calls: latency histograms per backend and operation, and a slow-query log.
+'''
+
+import json
+import logging
+import threading
+import time
+from functools import wraps
+from hashlib import sha1
+
+class METRICS:
+    SLOW_MS = 200 # default threshold of the slow-query log, 'slow_query_ms' in app.ini overrides it
+    BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000] # upper bounds, the last bucket is unbounded
+    LOGGER = 'queries'
+
+class Histogram:
+    '''
+    Latencies of 1 operation of 1 backend, in fixed buckets so recording stays O(1)
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.totalMs = 0.0
+        self.minMs = None
+        self.maxMs = None
+        self.buckets = [0] * (len(METRICS.BUCKETS_MS) + 1)
+
+    def observe(self, ms: float, rows: int, failed: bool) -> None:
+        self.count += 1
+        self.totalMs += ms
+        self.minMs = ms if self.minMs is None else min(self.minMs, ms)
+        self.maxMs = ms if self.maxMs is None else max(self.maxMs, ms)
+        if failed:
+            self.errors += 1
+        if rows is not None:
+            self.rows += rows
+        i = 0
+        while i < len(METRICS.BUCKETS_MS) and ms > METRICS.BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+
+    def percentile(self, p: float) -> float:
+        '''
+        Upper bound of the bucket holding the p-th percentile, capped by the max
+        '''
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return min(METRICS.BUCKETS_MS[i], self.maxMs) if i < len(METRICS.BUCKETS_MS) else self.maxMs
+        return self.maxMs
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'mean_ms': self.totalMs / self.count if self.count > 0 else None,
+            'min_ms': self.minMs,
+            'max_ms': self.maxMs,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'buckets': dict(zip(['<=%d' % b for b in METRICS.BUCKETS_MS] + ['>%d' % METRICS.BUCKETS_MS[-1]], self.buckets))
+        }
+
+class Metrics:
+    '''
+    In-process registry of the histograms, shared by every thread
+    '''
+
+    def __init__(self):
+        self.slowMs = METRICS.SLOW_MS
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._log = logging.getLogger(METRICS.LOGGER)
+
+    def record(self, backend: str, op: str, params: str, ms: float, rows: int = None, error: Exception = None) -> None:
+        key = (backend, op)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(ms, rows, error is not None)
+
+        slow = ms >= self.slowMs
+        if slow or self._log.isEnabledFor(logging.DEBUG): # DEBUG when the structured log is on
+            fields = {'backend': backend, 'op': op, 'ms': round(ms, 3), 'rows': rows, 'params': params, 'error': None if error is None else repr(error)}
+            if slow:
+                self._log.warning('[SLOW QUERY] [%s] %s took %.1f ms (params %s, rows %s%s)' % (backend, op, ms, params, '-' if rows is None else rows, '' if error is None else ', failed: %r' % error), extra=fields)
+            else:
+                self._log.debug('[%s] %s took %.1f ms' % (backend, op, ms), extra=fields)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms = {}
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {'%s.%s' % key: self._histograms[key].snapshot() for key in sorted(self._histograms)}
+
+    def dumpText(self) -> str:
+        lines = ['%-32s %7s %6s %9s %9s %9s %9s %9s' % ('operation', 'calls', 'errors', 'rows', 'mean ms', 'p50 ms', 'p95 ms', 'max ms')]
+        for name, s in self.dump().items():
+            lines.append('%-32s %7d %6d %9d %9.1f %9s %9s %9.1f' % (name, s['count'], s['errors'], s['rows'], s['mean_ms'], '%.0f' % s['p50_ms'], '%.0f' % s['p95_ms'], s['max_ms']))
+        return '\n'.join(lines)
+
+    def dumpFile(self, path: str) -> None:
+        with open(path, 'w', encoding='UTF-8') as f:
+            json.dump({'dumped': time.strftime('%Y-%m-%d %H:%M:%S'), 'slow_ms': self.slowMs, 'operations': self.dump()}, f, indent=2)
+
+metrics = Metrics()
+
+_context = threading.local()
+
+def setContext(values: dict) -> None:
+    '''
+    Who the DB calls of this thread are made for, e.g. {'client': 3}. Set by the tasks running them.
+    '''
+    _context.values = values
+
+def getContext() -> dict:
+    return getattr(_context, 'values', None) or {}
+
+def fingerprint(args: tuple, kwargs: dict) -> str:
+    '''
+    Short hash of the parameters: groups identical calls without logging their values (passwords among them)
+    '''
+    return sha1(repr((args, sorted(kwargs.items()))).encode('UTF-8', 'replace')).hexdigest()[:10]
+
+def countRows(res) -> int:
+    '''
+    Default row count: the length of list results and of the rows of (rows, cursor) pages
+    '''
+    if isinstance(res, list):
+        return len(res)
+    if isinstance(res, tuple) and len(res) == 2 and isinstance(res[0], list):
+        return len(res[0])
+    return None
+
+_active = threading.local()
+
+def _measure(backend: str, op: str, params: tuple, kwargs: dict, call, rows):
+    '''
+    Only the outermost measured call of a thread is recorded: the ones it makes are part of it, not calls of their own
+    '''
+    if getattr(_active, 'measuring', False):
+        return call()
+    _active.measuring = True
+    start = time.perf_counter()
+    try:
+        res = call()
+    except Exception as e:
+        metrics.record(backend, op, fingerprint(params, kwargs), (time.perf_counter() - start) * 1000, None, e)
+        raise
+    finally:
+        _active.measuring = False
+    metrics.record(backend, op, fingerprint(params, kwargs), (time.perf_counter() - start) * 1000, None if rows is None else rows(res))
+    return res
+
+def measure(backend: str, op: str, fn, *args, rows=countRows, **kwargs):
+    '''
+    Calls fn(*args, **kwargs) and records it, for the part of an operation that goes to 1 backend
+    '''
+    return _measure(backend, op, args, kwargs, lambda: fn(*args, **kwargs), rows)
+
+def timed(backend: str, op: str = None, rows=countRows):
+    '''
+    Decorator recording every call of a DB method in metrics, self is left out of the fingerprint.
+    rows(result) -> row count or None, rows=None counts nothing.
+    '''
+
+    def decorator(fn):
+        name = op or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return _measure(backend, name, args[1:], kwargs, lambda: fn(*args, **kwargs), rows)
+
+        return wrapper
+
+    return decorator
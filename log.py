@@ -1,29 +1,130 @@
 '''
-Logging module, both to UI and file.
+Logging module, both to UI and file, plus an optional JSON-lines sink for analysis tools.
 '''
 
+import atexit
+import gzip
+import json
 import logging
 import logging.handlers
-from os import mkdir
-from os.path import isdir, isfile
-from PyQt5.QtCore import QObject, pyqtSignal
+import shutil
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from glob import glob
+from queue import SimpleQueue
+from os import mkdir, remove
+from os.path import isdir, isfile, getmtime
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QWidget, QPlainTextEdit, QVBoxLayout
 from PyQt5.QtGui import QCloseEvent
+from instrument import getContext
 
 PATH_LOG_FOLDER = './logs'
 PATH_LOG = PATH_LOG_FOLDER + '/log.txt'
+PATH_JSON_LOG = PATH_LOG_FOLDER + '/ops.jsonl'
+
+class LOG:
+    FLUSH_MS = 100 # how often the window takes the pending lines
+    MAX_LINES = 5000 # kept by the window, older ones are dropped
+    MAX_BYTES = 5 * 1024 * 1024
+    BACKUPS = 10
+    JSON_MAX_BYTES = 50 * 1024 * 1024
+    JSON_INTERVAL = 24 * 3600 # seconds
+    JSON_BACKUPS = 30
+    JSON_FIELDS = ['client', 'backend', 'op', 'ms', 'rows', 'params', 'error'] # set through "extra" by instrument
+
+class _ContextFilter(logging.Filter):
+    '''
+    Stamps records with the client window they are logged for, on the logging thread, before they are queued
+    '''
+
+    def filter(self, record):
+        if not hasattr(record, 'client'):
+            record.client = getContext().get('client')
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'), 'level': record.levelname, 'logger': record.name, 'msg': record.getMessage()}
+        for field in LOG.JSON_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class JsonLinesHandler(logging.handlers.BaseRotatingHandler):
+    '''
+    Rotates when the file reaches maxBytes or is interval seconds old, whichever comes first.
+    Rotated files are gzipped as <file>.<time>.gz, only the newest backupCount are kept.
+    '''
+
+    def __init__(self, filename: str, maxBytes: int, interval: int, backupCount: int):
+        super().__init__(filename, 'a', encoding='UTF-8', delay=True)
+        self.maxBytes = maxBytes
+        self.interval = interval
+        self.backupCount = backupCount
+        self.rotator = JsonLinesHandler._gzip
+        start = getmtime(filename) if isfile(filename) else time.time()
+        self.rolloverAt = start + interval
+
+    @staticmethod
+    def _gzip(source: str, dest: str) -> None:
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        remove(source)
+
+    def shouldRollover(self, record) -> bool:
+        if time.time() >= self.rolloverAt:
+            return isfile(self.baseFilename)
+        if self.stream is None:
+            self.stream = self._open()
+        return self.stream.tell() >= self.maxBytes
+
+    def doRollover(self) -> None:
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if isfile(self.baseFilename):
+            self.rotate(self.baseFilename, '%s.%s.gz' % (self.baseFilename, datetime.now().strftime('%Y%m%d-%H%M%S-%f')))
+        for old in sorted(glob(self.baseFilename + '.*.gz'))[:-self.backupCount]:
+            try:
+                remove(old)
+            except:
+                pass # ignore
+        self.rolloverAt = time.time() + self.interval
 
 class Logger():
     '''
-    Should be used only (but implicitly) with a started QApplication and a parent QMainWindow
+    Should be used only (but implicitly) with a started QApplication and a parent QMainWindow.
+    Records only go into a queue on the calling thread: a listener thread formats them and writes the file,
+    the window picks the lines up on a timer.
     '''
 
-    def __init__(self):
+    def __init__(self, structured: bool = False):
+        '''
+        structured: also write JSON lines to PATH_JSON_LOG, including the timing of every DB call
+        '''
         self.uiHandler = Logger._UILogHandler()
         self.fileHandler = self._createFileHandler()
         self._setLogFormats()
-        logging.getLogger().addHandler(self.uiHandler)
-        logging.getLogger().addHandler(self.fileHandler)
+        handlers = [self.uiHandler, self.fileHandler]
+        self.jsonHandler = None
+        if structured:
+            self.jsonHandler = JsonLinesHandler(PATH_JSON_LOG, LOG.JSON_MAX_BYTES, LOG.JSON_INTERVAL, LOG.JSON_BACKUPS)
+            self.jsonHandler.setFormatter(JsonFormatter())
+            self.jsonHandler.setLevel(logging.DEBUG)
+            handlers.append(self.jsonHandler)
+            logging.getLogger('queries').setLevel(logging.DEBUG) # per-call timings, for this sink only
+
+        self.queue = SimpleQueue()
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop) # flushes what is still queued
+        queueHandler = logging.handlers.QueueHandler(self.queue)
+        queueHandler.addFilter(_ContextFilter())
+        logging.getLogger().addHandler(queueHandler)
 
     def window(self) -> QWidget:
         return self.uiHandler.window
@@ -33,23 +134,26 @@ class Logger():
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s\n' + SEPARATOR)
         self.uiHandler.setFormatter(formatter)
         self.fileHandler.setFormatter(formatter)
+        self.uiHandler.setLevel(logging.INFO)
+        self.fileHandler.setLevel(logging.INFO)
         logging.getLogger().setLevel(logging.INFO)
 
     def log(self, msg: str) -> None:
         logging.info(msg)
-        self.uiHandler.window.repaint()
 
     def error(self, e: Exception) -> None:
-        logging.exception(e)
-        self.uiHandler.window.repaint()
+        logging.error(e, exc_info=e)
 
-    class _UILogHandler(logging.Handler, QObject):
-        _appendText = pyqtSignal(str)
+    class _UILogHandler(logging.Handler):
+        '''
+        Called on the listener thread, only buffers the lines. A timer on the GUI thread appends them in 1 go.
+        '''
 
         def __init__(self):
             super().__init__()
-            QObject.__init__(self)
             self.window = Logger._UILogHandler._LogWindow()
+            self._pending = deque(maxlen=LOG.MAX_LINES) # a burst longer than the window keeps anyway is cut here already
+            self._pendingLock = threading.Lock()
             self._createBindings()
 
         class _LogWindow(QWidget):
@@ -60,6 +164,7 @@ class Logger():
                 layout = QVBoxLayout(self)
                 logArea = QPlainTextEdit(self)
                 logArea.setReadOnly(True)
+                logArea.setMaximumBlockCount(LOG.MAX_LINES)
                 layout.addWidget(logArea)
                 self.setLayout(layout)
                 self.logArea = logArea
@@ -69,18 +174,26 @@ class Logger():
                 event.ignore()            
 
         def _createBindings(self):
-            self._appendText.connect(self.window.logArea.appendPlainText)
+            timer = QTimer(self.window)
+            timer.timeout.connect(self._flush)
+            timer.start(LOG.FLUSH_MS)
+            self.timer = timer
 
         def emit(self, record):
             msg = self.format(record)
-            self._appendText.emit(msg)
+            with self._pendingLock:
+                self._pending.append(msg)
+
+        def _flush(self):
+            with self._pendingLock:
+                if len(self._pending) == 0:
+                    return
+                lines = list(self._pending)
+                self._pending.clear()
+            self.window.logArea.appendPlainText('\n'.join(lines))
 
     def _createFileHandler(self):
         if not isdir(PATH_LOG_FOLDER):
             mkdir(PATH_LOG_FOLDER)
 
-        handler = logging.handlers.RotatingFileHandler(PATH_LOG, delay=True, backupCount=10)
-        if isfile(PATH_LOG):
-            handler.doRollover()
-
-        return handler
\ No newline at end of file
+        return logging.handlers.RotatingFileHandler(PATH_LOG, maxBytes=LOG.MAX_BYTES, backupCount=LOG.BACKUPS, encoding='UTF-8', delay=True)
\ No newline at end of file
@@ -0,0 +1,337 @@
+'''
+Table models and item delegates for the client grids.
+'''
+
+from datetime import date
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QDate, pyqtSignal
+from PyQt5.QtWidgets import QStyledItemDelegate, QDateEdit, QComboBox
+
+class KIND:
+    TEXT = 'text'
+    INT = 'int'
+    DATE = 'date'
+    BOOL = 'bool'
+    CHOICE = 'choice'
+
+class CHANGE:
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+
+class Change:
+    '''
+    What 1 write did to 1 row, so that the other windows can patch just that row.
+    values is the whole row (for UPSERT), in the same column order as the grids.
+    '''
+
+    def __init__(self, kind: str, key, values: list = None):
+        self.kind = kind
+        self.key = key
+        self.values = values
+
+class Column:
+    def __init__(self, title: str, kind: str = KIND.TEXT, editable: bool = True, choices=None, sortable: bool = True):
+        '''
+        choices: callable returning the list of options of a CHOICE column
+        sortable: False when the fetcher cannot order by this column
+        '''
+        self.title = title
+        self.kind = kind
+        self.editable = editable
+        self.choices = choices
+        self.sortable = sortable
+
+class PagedTableModel(QAbstractTableModel):
+    '''
+    Rows are plain lists of values, fetched page by page through canFetchMore/fetchMore on worker threads.
+
+    fetcher(cursor, limit, sort, filters) -> (rows, nextCursor) runs on a worker thread,
+    cursor is None for the first page and nextCursor is None once there is nothing left.
+    sort is (column, ascending), filters is a dict understood by the fetcher.
+    runTask(name, fn, *args, onSuccess=...) -> Task starts a task, as ClientWindow._runTask does.
+    '''
+
+    PAGE_SIZE = 200
+
+    rowEdited = pyqtSignal(int, list) # row, its values after the edit
+    pageLoaded = pyqtSignal(int) # number of rows loaded so far
+
+    def __init__(self, columns: list, fetcher, runTask, name: str, sort: tuple = (0, True), parent=None):
+        super().__init__(parent)
+        self.columns = columns
+        self.name = name
+        self._fetcher = fetcher
+        self._runTask = runTask
+        self._sort = sort
+        self._filters = {}
+        self._rows = []
+        self._cursor = None
+        self._exhausted = True
+        self._task = None
+        self._generation = 0
+
+    # ----- loading
+
+    def reload(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._generation += 1
+        self.beginResetModel()
+        self._rows = []
+        self._cursor = None
+        self._exhausted = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        if parent.isValid():
+            return False
+        return not self._exhausted
+
+    def fetchMore(self, parent: QModelIndex) -> None:
+        if parent.isValid() or self._exhausted or self._task is not None:
+            return
+        generation = self._generation
+        self._task = self._runTask(self.name, self._fetcher, self._cursor, PagedTableModel.PAGE_SIZE, self._sort, dict(self._filters), onSuccess=lambda res: self._onPage(generation, res), onFinish=lambda: self._onFetchFinished(generation))
+
+    def _onPage(self, generation: int, res: tuple) -> None:
+        if generation != self._generation: # reloaded meanwhile
+            return
+        self._task = None
+        rows, self._cursor = res
+        self._exhausted = self._cursor is None
+        if len(rows) > 0:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self._rows.extend([list(r) for r in rows])
+            self.endInsertRows()
+        self.pageLoaded.emit(len(self._rows))
+
+    def _onFetchFinished(self, generation: int) -> None:
+        if generation == self._generation and self._task is not None: # failed or cancelled, errors are logged by the task runner
+            self._task = None
+            self._exhausted = True # retried by the next reload
+
+    def setFilters(self, filters: dict) -> None:
+        self._filters = dict(filters)
+        self.reload()
+
+    def sort(self, column: int, order=Qt.AscendingOrder) -> None:
+        sort = (column, order == Qt.AscendingOrder)
+        if sort == self._sort or not self.columns[column].sortable:
+            return
+        self._sort = sort
+        self.reload()
+
+    def sortState(self) -> tuple:
+        return self._sort
+
+    @staticmethod
+    def sortRows(rows: list, sort: tuple) -> list:
+        column, ascending = sort
+        return sorted(rows, key=lambda r: (r[column] is None, r[column]), reverse=not ascending)
+
+    # ----- row access
+
+    def rowValues(self, r: int) -> list:
+        return list(self._rows[r])
+
+    def findRow(self, key, column: int = 0) -> int:
+        for r, row in enumerate(self._rows):
+            if row[column] == key:
+                return r
+        return -1
+
+    def appendRow(self, values: list) -> int:
+        r = len(self._rows)
+        self.beginInsertRows(QModelIndex(), r, r)
+        self._rows.append(list(values))
+        self.endInsertRows()
+        return r
+
+    def updateRow(self, r: int, values: list) -> None:
+        self._rows[r] = list(values)
+        self.dataChanged.emit(self.index(r, 0), self.index(r, len(self.columns) - 1))
+
+    def removeRowsAt(self, rs: list) -> None:
+        for r in sorted(set(rs), reverse=True):
+            self.beginRemoveRows(QModelIndex(), r, r)
+            del self._rows[r]
+            self.endRemoveRows()
+
+    def removeKey(self, key, keyColumn: int = 0) -> None:
+        r = self.findRow(key, keyColumn)
+        if r >= 0:
+            self.removeRowsAt([r])
+
+    def _before(self, a: list, b: list) -> bool:
+        '''
+        Whether row a sorts strictly before row b
+        '''
+        column, ascending = self._sort
+        ka = (a[column] is None, a[column])
+        kb = (b[column] is None, b[column])
+        return ka < kb if ascending else kb < ka
+
+    def upsertRow(self, values: list, keyColumn: int = 0) -> None:
+        '''
+        Patch 1 row in place, or move/insert it where the current sort puts it among the loaded rows
+        '''
+        rows = self._rows
+        r = self.findRow(values[keyColumn], keyColumn)
+        if r >= 0:
+            if (r == 0 or not self._before(values, rows[r - 1])) and (r == len(rows) - 1 or not self._before(rows[r + 1], values)):
+                self.updateRow(r, values)
+                return
+            self.removeRowsAt([r])
+
+        pos = 0
+        while pos < len(rows) and not self._before(values, rows[pos]):
+            pos += 1
+        if pos == len(rows) and not self._exhausted:
+            return # belongs to the rows not fetched yet
+        self.beginInsertRows(QModelIndex(), pos, pos)
+        rows.insert(pos, list(values))
+        self.endInsertRows()
+
+    # ----- QAbstractTableModel
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section].title
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index: QModelIndex):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        column = self.columns[index.column()]
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if column.kind == KIND.BOOL:
+            flags |= Qt.ItemIsUserCheckable
+        elif column.editable:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self._rows[index.row()][index.column()]
+        kind = self.columns[index.column()].kind
+
+        if kind == KIND.BOOL:
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if value else Qt.Unchecked
+            return None
+
+        if role == Qt.DisplayRole or role == Qt.EditRole:
+            if kind == KIND.DATE and value is not None:
+                return QDate(value.year, value.month, value.day)
+            return value
+        return None
+
+    def setData(self, index: QModelIndex, value, role=Qt.EditRole) -> bool:
+        if not index.isValid():
+            return False
+        r = index.row()
+        kind = self.columns[index.column()].kind
+
+        if kind == KIND.BOOL:
+            if role != Qt.CheckStateRole:
+                return False
+            value = value == Qt.Checked
+        elif role != Qt.EditRole:
+            return False
+        elif kind == KIND.DATE and isinstance(value, QDate):
+            value = date(value.year(), value.month(), value.day())
+        elif kind == KIND.INT:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return False
+
+        if self._rows[r][index.column()] == value:
+            return False
+        self._rows[r][index.column()] = value
+        self.dataChanged.emit(index, index)
+        self.rowEdited.emit(r, list(self._rows[r]))
+        return True
+
+class DateDelegate(QStyledItemDelegate):
+    '''
+    A QDateEdit, only while the cell is being edited
+    '''
+
+    def createEditor(self, parent, option, index):
+        editor = QDateEdit(parent)
+        editor.setCalendarPopup(True)
+        return editor
+
+    def setEditorData(self, editor, index):
+        value = index.data(Qt.EditRole)
+        if value is not None:
+            editor.setDate(value)
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.date(), Qt.EditRole)
+
+class ChoiceDelegate(QStyledItemDelegate):
+    '''
+    A QComboBox of the column's choices, only while the cell is being edited
+    '''
+
+    def __init__(self, choices, parent=None):
+        super().__init__(parent)
+        self.choices = choices
+
+    def createEditor(self, parent, option, index):
+        editor = QComboBox(parent)
+        editor.addItems(self.choices() or [])
+        editor.activated.connect(lambda i: self._commit(editor))
+        return editor
+
+    def _commit(self, editor):
+        self.commitData.emit(editor)
+        self.closeEditor.emit(editor)
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data(Qt.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.EditRole)
+
+def keepSortIndicator(view, model: PagedTableModel) -> None:
+    '''
+    Put the header's sort arrow back when a non-sortable column is clicked
+    '''
+    headers = view.horizontalHeader()
+
+    def onChanged(column, order):
+        sortColumn, ascending = model.sortState()
+        if column != sortColumn or (order == Qt.AscendingOrder) != ascending:
+            if not model.columns[column].sortable:
+                headers.blockSignals(True)
+                headers.setSortIndicator(sortColumn, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
+                headers.blockSignals(False)
+
+    headers.sortIndicatorChanged.connect(onChanged)
+
+def setColumnDelegates(view, model: PagedTableModel) -> None:
+    '''
+    Install the editors matching the model's column kinds, the view keeps them alive
+    '''
+    view._delegates = []
+    for c, column in enumerate(model.columns):
+        delegate = None
+        if column.kind == KIND.DATE:
+            delegate = DateDelegate(view)
+        elif column.kind == KIND.CHOICE:
+            delegate = ChoiceDelegate(column.choices, view)
+        if delegate is not None:
+            view.setItemDelegateForColumn(c, delegate)
+            view._delegates.append(delegate)
@@ -0,0 +1,132 @@
+'''
+Connection pooling, so that several windows and worker threads can query at the same time.
+'''
+
+import threading
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+import mysql.connector
+
+class POOL:
+    SIZE = 5 # per DBMS, can be overridden by a 'pool_size' entry in its credentials
+    WAIT = 30 # seconds to wait for a free connection before giving up
+
+class PooledConnection:
+    '''
+    A MySQL connection checked out of a MySQLPool, together with its prepared statements.
+    '''
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self._stmts = {}
+
+    def cursor(self):
+        return self.cnx.cursor()
+
+    def prepared(self, sql: str):
+        '''
+        1 prepared cursor per statement, so each statement is only prepared once per connection
+        '''
+        cur = self._stmts.get(sql)
+        if cur is None:
+            cur = self.cnx.cursor(prepared=True)
+            self._stmts[sql] = cur
+        return cur
+
+    @contextmanager
+    def transaction(self):
+        '''
+        The statements run inside are committed once, together, or rolled back on an error
+        '''
+        self.cnx.start_transaction()
+        try:
+            yield self
+        except:
+            try:
+                self.cnx.rollback()
+            except:
+                pass # ignore, a lost connection rolls back by itself
+            raise
+        self.cnx.commit()
+
+    def close(self) -> None:
+        try:
+            for cur in self._stmts.values():
+                cur.close()
+            self.cnx.close()
+        except:
+            pass # ignore
+        self._stmts = {}
+
+class MySQLPool:
+    '''
+    Fixed-size, thread-safe pool of autocommit MySQL connections, opened lazily.
+    '''
+
+    def __init__(self, size: int, **kwargs):
+        self.size = size
+        self._kwargs = kwargs
+        self._idle = LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self) -> PooledConnection:
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise ConnectionError('MySQL pool already closed')
+            canOpen = self._opened < self.size
+            if canOpen:
+                self._opened += 1
+
+        if canOpen:
+            try:
+                cnx = mysql.connector.connect(**self._kwargs)
+                cnx.autocommit = True # every statement is its own transaction, no stale snapshots between reads
+                return PooledConnection(cnx)
+            except:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=POOL.WAIT)
+        except Empty:
+            raise TimeoutError('No free MySQL connection after %d seconds' % POOL.WAIT)
+
+    def _release(self, conn: PooledConnection, broken: bool) -> None:
+        if broken or self._closed:
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except mysql.connector.errors.OperationalError:
+            broken = True # lost connection, do not hand it out again
+            raise
+        except mysql.connector.errors.InterfaceError:
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
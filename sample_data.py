@@ -1,10 +1,14 @@
 from os import stat
+import time
 from mysql.connector.cursor import MySQLCursor
 import neo4j
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
 from redis import Redis
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from instrument import timed
 
 class PATH:
     DAT_FOLDER = './dat-scripts/'
@@ -17,76 +21,209 @@ class DB_NAME:
     UNDERSCORE_VERSION = 'hcmus_master_coffeehouse_sample'
     CAMEL_VERSION = 'HCMUSMasterCoffeeHouseSample' # Neo4j hates everything but simple db names
 
+class MONGO_INDEX:
+    UNIQUE = {'mems': ['id', 'username']} # collection -> fields of its unique indexes
+
+def ensureMongoIndexes(mongoDb) -> None:
+    '''
+    Creating an index that already exists is a no-op in MongoDB, so this is safe on every pickup
+    '''
+    for collection in MONGO_INDEX.UNIQUE:
+        for field in MONGO_INDEX.UNIQUE[collection]:
+            mongoDb[collection].create_index([(field, ASCENDING)], unique=True, name='UX_%s' % field)
+
+class BULK:
+    BATCH = 1000 # rows / documents / keys per round trip
+    PIPELINE = 50 # Redis batches buffered before sending them, bounds the client's memory
+
+def chunks(items, size: int = None):
+    '''
+    Lists of up to size items from any iterable, so generators are streamed rather than built up front
+    '''
+    it = iter(items)
+    size = size or BULK.BATCH
+    while True:
+        chunk = list(islice(it, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+class SeedStatus:
+    def __init__(self, backend: str, ok: bool, elapsed: float, error: Exception = None):
+        self.backend = backend
+        self.ok = ok
+        self.elapsed = elapsed
+        self.error = error
+
+    def __str__(self):
+        if self.ok:
+            return '%s: seeded in %.0f ms' % (self.backend, self.elapsed * 1000)
+        return '%s: FAILED after %.0f ms (%s)' % (self.backend, self.elapsed * 1000, self.error)
+
 class SampleData():
     '''
     Should manually catch exception from any db operation when using this class!
     '''
 
-    def __init__(self, mysqlCur: MySQLCursor, neo4jSess: neo4j.Session, mongo: MongoClient, redis: Redis, credentials: dict):
+    def __init__(self, mysqlCur: MySQLCursor, neo4jSess: neo4j.Session, mongo: MongoClient, redis: Redis, credentials: dict, neo4jDriver: neo4j.Driver = None):
         self.mysqlCur = mysqlCur
         self.credentials = credentials
         self.neo4jSess = neo4jSess
+        self.neo4jDriver = neo4jDriver # for sessions on the sample database, the UNWIND loader needs it
         self.mongo = mongo
         self.redis = redis
 
-    def createAll(self) -> None:
-        self.createMySQL()
-        self.createNeo4j()
-        self.createMongo()
-        self.createRedis()
-
-    def createMySQL(self) -> None:
+    def createAll(self, progress=None) -> dict:
+        return self.create(['mysql', 'neo4j', 'mongo', 'redis'], progress)
+
+    def create(self, backends: list, progress=None) -> dict:
+        '''
+        Seed the given DBMSs concurrently. Each loader only touches its own connection,
+        and a failing one does not stop the others: check the returned SeedStatus of each backend.
+        progress(status) is called from the worker threads as each backend finishes.
+        '''
+        loaders = {'mysql': self.createMySQL, 'neo4j': self.createNeo4j, 'mongo': self.createMongo, 'redis': self.createRedis}
+
+        def seed(backend):
+            start = time.perf_counter()
+            try:
+                loaders[backend]()
+                status = SeedStatus(backend, True, time.perf_counter() - start)
+            except Exception as e:
+                status = SeedStatus(backend, False, time.perf_counter() - start, e)
+            if progress is not None:
+                progress(status)
+            return status
+
+        if len(backends) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(backends)) as executor:
+            futures = {i: executor.submit(seed, i) for i in backends}
+            return {i: futures[i].result() for i in futures}
+
+    @staticmethod
+    def _statements(path: str, comment: str = None) -> list:
+        statements = []
         statement = ''
-        with open(PATH.MYSQL_DATA_SCRIPT, 'r', encoding='UTF-8') as f:
+        with open(path, 'r', encoding='UTF-8') as f:
             for line in f:
                 line = line.strip()
-                if line == '' or line.startswith('--'):
+                if line == '' or (comment is not None and line.startswith(comment)):
                     continue
                 statement += ' ' + line
                 if line.endswith(';'):
-                    self.mysqlCur.execute(statement)
+                    statements.append(statement.strip())
                     statement = ''
+        return statements
 
+    @timed('mysql')
+    def createMySQL(self) -> None:
+        '''
+        The whole script in 1 round trip, each run of INSERTs in 1 transaction
+        '''
+        script = []
+        inserting = False
+        for statement in SampleData._statements(PATH.MYSQL_DATA_SCRIPT, '--'):
+            isInsert = statement.upper().startswith('INSERT')
+            if isInsert and not inserting:
+                script.append('START TRANSACTION;')
+            elif inserting and not isInsert:
+                script.append('COMMIT;')
+            inserting = isInsert
+            script.append(statement)
+        if inserting:
+            script.append('COMMIT;')
+
+        for res in self.mysqlCur.execute(' '.join(script), multi=True):
+            pass # the statements only run as their results are consumed
+
+    @timed('mysql')
+    def insertMySQL(self, table: str, columns: list, rows) -> None:
+        '''
+        Bulk insert into the sample database, all in 1 transaction.
+        executemany rewrites each batch into 1 multi-row INSERT.
+        '''
+        cur = self.mysqlCur
+        sql = 'INSERT INTO %s.%s (%s) VALUES (%s)' % (DB_NAME.UNDERSCORE_VERSION, table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+        cur.execute('START TRANSACTION')
+        try:
+            for batch in chunks(rows):
+                cur.executemany(sql, batch)
+            cur.execute('COMMIT')
+        except:
+            cur.execute('ROLLBACK')
+            raise
+
+    @timed('neo4j')
     def createNeo4j(self) -> None:
-        statement = ''
-        with open(PATH.NEO4J_DATA_SCRIPT, 'r', encoding='UTF-8') as f:
-            for line in f:
-                line = line.strip()
-                if line == '':
-                    continue
-                statement += ' ' + line
-                if line.endswith(';'):
-                    self.neo4jSess.run(statement)
-                    statement = ''
-
+        for statement in SampleData._statements(PATH.NEO4J_DATA_SCRIPT):
+            self.neo4jSess.run(statement).consume() # the whole graph is already 1 CREATE, so 1 transaction
+
+    @timed('neo4j')
+    def unwindNeo4j(self, query: str, rows) -> None:
+        '''
+        Bulk write into the sample graph: query gets 1 batch of rows as $rows, e.g.
+        "UNWIND $rows AS r CREATE (:Branch {name: r.name})". 1 transaction per batch.
+        '''
+        with self.neo4jDriver.session(database=DB_NAME.CAMEL_VERSION) as neo4jSess:
+            for batch in chunks(rows):
+                neo4jSess.write_transaction(lambda tx: tx.run(query, rows=batch).consume())
+
+    @timed('mongo')
     def createMongo(self) -> None:
         f = open(PATH.MONGO_DATA_FILE, 'r', encoding='UTF-8')
 
         self.mongo.drop_database(DB_NAME.UNDERSCORE_VERSION)
-        mgdb = self.mongo[DB_NAME.UNDERSCORE_VERSION] # Delayed until 1 collection, 1 record created
+        ensureMongoIndexes(self.mongo[DB_NAME.UNDERSCORE_VERSION]) # before the documents, so duplicates are rejected
 
         dat = json.load(f)
         for c in dat:
-            col = mgdb[c]
-            for r in dat[c]:
-                doc = dat[c][r]
-                if c == 'mems':
+            docs = list(dat[c].values())
+            if c == 'mems':
+                for doc in docs:
                     doc['birth'] = datetime.strptime(doc['birth'], '%Y-%m-%d')
-                col.insert_one(doc)
+            self.insertMongo(c, docs)
 
         f.close()
 
+    @timed('mongo')
+    def insertMongo(self, collection: str, docs) -> None:
+        col = self.mongo[DB_NAME.UNDERSCORE_VERSION][collection] # Delayed until 1 collection, 1 record created
+        for batch in chunks(docs):
+            col.insert_many(batch, ordered=False)
+
+    @timed('redis')
     def createRedis(self) -> None:
         f = open(PATH.REDIS_DATA_FILE, 'r', encoding='UTF-8')
-        redis = self.redis
-
         dat = json.load(f)
-        for key in dat:
-            redis.set(key, dat[key])
+        f.close()
 
-    def checkDataAvailability(self) -> dict:
-        return {'mysql': self.isMySQLDataAvailable(), 'neo4j': self.isNeo4jDataAvailable(), 'mongo': self.isMongoDataAvailable, 'redis': self.isRedisDataAvailable}
+        self.setRedis(dat)
+
+    @timed('redis')
+    def setRedis(self, items) -> None:
+        '''
+        Pipelined MSETs of a dict or an iterable of (key, value), 1 round trip per BULK.PIPELINE batches
+        '''
+        if isinstance(items, dict):
+            items = items.items()
+        pipe = self.redis.pipeline(transaction=False)
+        for i, batch in enumerate(chunks(items)):
+            pipe.mset(dict(batch))
+            if (i + 1) % BULK.PIPELINE == 0:
+                pipe.execute()
+        pipe.execute()
 
+    def checkDataAvailability(self) -> dict:
+        '''
+        Probe the 4 DBMSs concurrently, each one uses its own connection
+        '''
+        probes = {'mysql': self.isMySQLDataAvailable, 'neo4j': self.isNeo4jDataAvailable, 'mongo': self.isMongoDataAvailable, 'redis': self.isRedisDataAvailable}
+        with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+            futures = {i: executor.submit(probes[i]) for i in probes}
+            return {i: futures[i].result() for i in futures}
+
+    @timed('mysql')
     def isMySQLDataAvailable(self) -> bool:
         mysqlCur = self.mysqlCur
         mysqlCur.execute("show databases like %s", (DB_NAME.UNDERSCORE_VERSION,))
@@ -95,6 +232,7 @@ class SampleData():
             return False
         return True 
 
+    @timed('neo4j')
     def isNeo4jDataAvailable(self) -> bool:
         neo4jSess = self.neo4jSess
         res = neo4jSess.run('show database %s' % DB_NAME.CAMEL_VERSION)
@@ -102,10 +240,12 @@ class SampleData():
             return False
         return True   
 
+    @timed('mongo')
     def isMongoDataAvailable(self) -> bool:
         if DB_NAME.UNDERSCORE_VERSION in self.mongo.list_database_names():
             return True
         return False
 
+    @timed('redis')
     def isRedisDataAvailable(self) -> bool:
         return True # Currently no sample data, no need to check
\ No newline at end of file
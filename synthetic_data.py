@@ -0,0 +1,214 @@
+'''
+Large, realistic sample data for load testing, on top of the fixed sample scripts.
+
+    python synthetic_data.py --members 1000000 --employees 100000 --seed 7
+
+Generated members log in with the password SYNTHETIC.PASSWORD.
+'''
+
+import argparse
+import random
+from datetime import date, datetime, timedelta
+from hashlib import sha256
+from sample_data import SampleData
+
+class SYNTHETIC:
+    PROFILE = {'products': 2000, 'branches': 200, 'employees': 10000, 'members': 100000} # at scale 1
+    PASSWORD = 'coffeehouse'
+    AVATARS = ['assets/avatars/default.png', 'assets/avatars/doraemon.png', 'assets/avatars/doraemon2.png', 'assets/avatars/nobita.jpg']
+
+    # What the fixed scripts already contain, generated data continues from there
+    SAMPLE_SHOPS = 10
+    SAMPLE_EMPLOYEES = 43
+    SAMPLE_MEMBERS = 2
+    SAMPLE_LOCATIONS = [('Quận 1', 'TP. Hồ Chí Minh'), ('Quận 3', 'TP. Hồ Chí Minh'), ('Quận 5', 'TP. Hồ Chí Minh'), ('Quận 7', 'TP. Hồ Chí Minh'), ('Huyện Nhà Bè', 'TP. Hồ Chí Minh')]
+    HEADQUARTER = 'Tổng công ty'
+
+class _NAMES:
+    FAMILY = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng', 'Bùi', 'Đỗ', 'Hồ', 'Ngô', 'Dương', 'Lý']
+    MIDDLE_MALE = ['Văn', 'Minh', 'Hữu', 'Đức', 'Quốc', 'Thanh', 'Hoàng', 'Gia']
+    MIDDLE_FEMALE = ['Thị', 'Ngọc', 'Thu', 'Thanh', 'Bảo', 'Diễm', 'Phương', 'Mỹ']
+    GIVEN_MALE = ['An', 'Bình', 'Cường', 'Dũng', 'Hải', 'Hùng', 'Khoa', 'Khải', 'Long', 'Nam', 'Phúc', 'Quân', 'Sơn', 'Thắng', 'Thế', 'Trung', 'Tuấn', 'Việt']
+    GIVEN_FEMALE = ['Anh', 'Châu', 'Dung', 'Hà', 'Hạnh', 'Hoa', 'Hương', 'Lan', 'Linh', 'Mai', 'My', 'Nga', 'Ngân', 'Oanh', 'Phương', 'Thảo', 'Trang', 'Vy']
+    PROVINCES = ['Hà Nội', 'Đà Nẵng', 'Hải Phòng', 'Cần Thơ', 'Bình Dương', 'Đồng Nai', 'Khánh Hòa', 'Lâm Đồng', 'Bà Rịa - Vũng Tàu', 'Thừa Thiên Huế', 'Quảng Ninh', 'Nghệ An']
+    DISTRICTS_PER_PROVINCE = 8
+
+class _CATALOGUE:
+    # type ID (as in create_sample_data.sql) -> (product bases, price range in thousands, weight)
+    TYPES = {
+        1: (['Cà phê sữa', 'Cà phê đen', 'Bạc sỉu'], (29, 45), 12),
+        2: (['Latte', 'Cappuccino', 'Americano', 'Mocha', 'Macchiato'], (39, 65), 14),
+        3: (['Cold brew'], (42, 59), 6),
+        4: (['Trà'], (39, 55), 14),
+        5: (['Trà sữa', 'Hồng trà Macchiato'], (42, 59), 12),
+        6: (['Đá xay'], (49, 65), 8),
+        7: (['Sinh tố', 'Nước ép'], (45, 65), 8),
+        8: (['Matcha Latte', 'Sô cô la'], (49, 65), 8),
+        9: (['Bánh mì', 'Bánh bao', 'Mochi', 'Cookies'], (10, 39), 10),
+        10: (['Cà phê gói', 'Cà phê phin'], (90, 250), 4),
+        11: (['Bình giữ nhiệt', 'Cốc sứ', 'Túi vải'], (90, 450), 4),
+    }
+    FLAVOURS = ['đào', 'vải', 'cam sả', 'hạt sen', 'việt quất', 'phúc bồn tử', 'caramel', 'dừa', 'muối', 'oolong', 'kem cheese', 'trân châu', 'mật ong', 'gừng', 'bạc hà', 'xoài']
+
+class _STAFF:
+    DEPARTMENTS_SHOP = [('Kinh doanh', 85), ('Quản lý vật tư', 15)]
+    DEPARTMENTS_HQ = [('Điều hành', 10), ('Nhân sự', 20), ('Truyền thông - Marketing', 25), ('Nghiên cứu - phát triển', 25), ('Kinh doanh', 20)]
+    HQ_SHARE = 0.03 # of the staff working at the headquarter
+
+class SyntheticData(SampleData):
+    '''
+    The fixed sample data plus generated rows, streamed into the 4 DBMSs through the bulk loaders.
+    counts: products, branches (shops in total), employees and members to add. Same seed, same data.
+    '''
+
+    def __init__(self, mysqlCur, neo4jSess, mongo, redis, credentials: dict, neo4jDriver, counts: dict = None, seed: int = 0):
+        super().__init__(mysqlCur, neo4jSess, mongo, redis, credentials, neo4jDriver)
+        self.counts = dict(SYNTHETIC.PROFILE)
+        self.counts.update(counts or {})
+        self.seed = seed
+
+    def _random(self, backend: str) -> random.Random:
+        return random.Random('%s-%s' % (self.seed, backend)) # 1 per loader, they run concurrently
+
+    # ----- MySQL
+
+    def createMySQL(self) -> None:
+        super().createMySQL()
+        self.insertMySQL('Product', ['PName', 'OnSale', 'OnSaleFrom', 'Price', 'PType'], self.products())
+
+    def products(self):
+        rng = self._random('mysql')
+        types = list(_CATALOGUE.TYPES)
+        weights = [_CATALOGUE.TYPES[t][2] for t in types]
+        start = date(2014, 1, 1)
+        for i in range(self.counts['products']):
+            ptype = rng.choices(types, weights)[0]
+            bases, (low, high), weight = _CATALOGUE.TYPES[ptype]
+            name = '%s %s #%d' % (rng.choice(bases), rng.choice(_CATALOGUE.FLAVOURS), i + 1) # PName is UNIQUE
+            yield (name, 1 if rng.random() < 0.85 else 0, start + timedelta(days=rng.randrange(3650)), rng.randint(low, high) * 1000, ptype)
+
+    # ----- Neo4j
+
+    def createNeo4j(self) -> None:
+        super().createNeo4j()
+        rng = self._random('neo4j')
+        locations = SYNTHETIC.SAMPLE_LOCATIONS + self._newLocations()
+        self.unwindNeo4j('UNWIND $rows AS r MERGE (p:Location:Province {name: r.province}) ON CREATE SET p:City CREATE (:Location:District {name: r.district})-[:IN]->(p)',
+                         ({'district': d, 'province': p} for d, p in self._newLocations()))
+        self.unwindNeo4j('UNWIND $rows AS r MATCH (d:District {name: r.district})-[:IN]->(:Province {name: r.province}) CREATE (:Branch:Shop {name: r.name})-[:IN]->(d)',
+                         self.branches(rng, locations))
+        self.unwindNeo4j('UNWIND $rows AS r MATCH (j:JobTitle {name: r.job}), (d:Department {name: r.dep}), (b:Branch {name: r.branch}) '
+                         'CREATE (n:Person:Employee {id: r.id, name: r.name, birth: date(r.birth), male: r.male}), (n)-[:IS]->(j), (n)-[:IN]->(d), (n)-[:WORKS_AT]->(b) '
+                         'FOREACH (x IN CASE WHEN r.manages THEN [1] ELSE [] END | CREATE (n)-[:MANAGES]->(b))',
+                         self.employees(rng))
+
+    def _newLocations(self) -> list:
+        return [('Quận %d' % (i + 1), p) for p in _NAMES.PROVINCES for i in range(_NAMES.DISTRICTS_PER_PROVINCE)]
+
+    def _shopNames(self) -> list:
+        return ['The Coffee House %d' % (i + 1) for i in range(max(self.counts['branches'], SYNTHETIC.SAMPLE_SHOPS))]
+
+    def branches(self, rng: random.Random, locations: list):
+        for name in self._shopNames()[SYNTHETIC.SAMPLE_SHOPS:]:
+            district, province = rng.choice(locations)
+            yield {'name': name, 'district': district, 'province': province}
+
+    def employees(self, rng: random.Random):
+        shops = self._shopNames()
+        managed = set(shops[:SYNTHETIC.SAMPLE_SHOPS] + [SYNTHETIC.HEADQUARTER]) # managed by the fixed employees
+        for i in range(self.counts['employees']):
+            male = rng.random() < 0.5
+            name = '%s %s %s' % (rng.choice(_NAMES.FAMILY), rng.choice(_NAMES.MIDDLE_MALE if male else _NAMES.MIDDLE_FEMALE), rng.choice(_NAMES.GIVEN_MALE if male else _NAMES.GIVEN_FEMALE))
+            birth = date(1965, 1, 1) + timedelta(days=rng.randrange(365 * 40))
+
+            if rng.random() < _STAFF.HQ_SHARE:
+                branch = SYNTHETIC.HEADQUARTER
+                dep = _weighted(rng, _STAFF.DEPARTMENTS_HQ)
+                job = 'Giám đốc' if rng.random() < 0.05 else ('Quản lý' if rng.random() < 0.2 else 'Nhân viên')
+            else:
+                branch = shops[i % len(shops)] # spread evenly, the first 1 of each shop manages it
+                dep = _weighted(rng, _STAFF.DEPARTMENTS_SHOP)
+                job = 'Quản lý' if branch not in managed else 'Nhân viên'
+
+            manages = job == 'Quản lý' and branch not in managed
+            if manages:
+                managed.add(branch)
+            yield {'id': 'E%d' % (SYNTHETIC.SAMPLE_EMPLOYEES + i + 1), 'name': name, 'birth': birth.isoformat(), 'male': male, 'job': job, 'dep': dep, 'branch': branch, 'manages': manages}
+
+    # ----- MongoDB
+
+    def createMongo(self) -> None:
+        super().createMongo()
+        self.insertMongo('mems', self.members(self._random('mongo')))
+        # mem_levels keeps listing the fixed members only: 1 array of millions of IDs would pass the 16 MB document limit
+
+    @staticmethod
+    def memberID(i: int) -> str:
+        '''
+        Like TCHMID0000001YS, derived from the index alone so MongoDB and Redis agree without sharing a generator
+        '''
+        n = SYNTHETIC.SAMPLE_MEMBERS + i + 1
+        return 'TCHMID%07d%s%s' % (n, chr(65 + n * 7 % 26), chr(65 + n * 11 % 26))
+
+    def members(self, rng: random.Random):
+        password = sha256(bytes(SYNTHETIC.PASSWORD, encoding='UTF-8')).hexdigest()
+        for i in range(self.counts['members']):
+            male = rng.random() < 0.4
+            family = rng.choice(_NAMES.FAMILY)
+            given = rng.choice(_NAMES.GIVEN_MALE if male else _NAMES.GIVEN_FEMALE)
+            username = 'member%d' % (i + 1)
+            yield {
+                'id': SyntheticData.memberID(i),
+                'username': username,
+                'password': password,
+                'level': 'VIP' if rng.random() < 0.1 else 'Standard',
+
+                'fullname': '%s %s %s' % (family, rng.choice(_NAMES.MIDDLE_MALE if male else _NAMES.MIDDLE_FEMALE), given),
+                'birth': datetime(1960, 1, 1) + timedelta(days=rng.randrange(365 * 45)),
+                'phone': '09%08d' % rng.randrange(10 ** 8),
+                'email': '%s@example.com' % username,
+                'address': '%d đường số %d, %s, %s' % (rng.randint(1, 500), rng.randint(1, 50), *rng.choice(SYNTHETIC.SAMPLE_LOCATIONS))
+            }
+
+    # ----- Redis
+
+    def createRedis(self) -> None:
+        super().createRedis()
+        self.setRedis(self.avatarKeys())
+
+    def avatarKeys(self):
+        for i in range(self.counts['members']):
+            yield '%s-avatar_path' % SyntheticData.memberID(i), SYNTHETIC.AVATARS[i % len(SYNTHETIC.AVATARS)]
+
+def _weighted(rng: random.Random, options: list):
+    return rng.choices([o for o, w in options], [w for o, w in options])[0]
+
+def main():
+    parser = argparse.ArgumentParser(description='Recreate the sample databases with generated data at scale. Generated members log in with the password "%s".' % SYNTHETIC.PASSWORD)
+    parser.add_argument('--credentials', default='db_credentials.json', help='DBMS connection information, as for the app')
+    parser.add_argument('--scale', type=float, default=1, help='multiplies the default counts %s' % SYNTHETIC.PROFILE)
+    parser.add_argument('--seed', type=int, default=0)
+    for key in SYNTHETIC.PROFILE:
+        parser.add_argument('--' + key, type=int, help='overrides the scaled count')
+    parser.add_argument('--only', nargs='+', choices=['mysql', 'neo4j', 'mongo', 'redis'], help='seed these DBMSs only')
+    args = parser.parse_args()
+
+    counts = {}
+    for key in SYNTHETIC.PROFILE:
+        value = getattr(args, key)
+        counts[key] = value if value is not None else int(SYNTHETIC.PROFILE[key] * args.scale)
+
+    from db import Wrapper # the app's connection handling, imported late so --help works without the drivers
+    dbWrapper = Wrapper()
+    dbWrapper.connect(args.credentials)
+    try:
+        data = SyntheticData(dbWrapper.mysqlCur, dbWrapper.neo4jSess, dbWrapper.mongo, dbWrapper.redis, dbWrapper.credentials, dbWrapper.neo4j, counts, args.seed)
+        dbWrapper.sampleData = data
+        print('Seeding %s with seed %d...' % (counts, args.seed))
+        dbWrapper.createSampleData(args.only, print)
+        dbWrapper.pickupDatabase() # creates the indexes the app expects
+    finally:
+        dbWrapper.disconnect()
+
+if __name__ == '__main__':
+    main()
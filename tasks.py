@@ -0,0 +1,143 @@
+'''
+Running DB work on worker threads, results come back to the GUI thread through Qt signals.
+'''
+
+from collections import deque
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtWidgets import QLabel, QStatusBar
+from instrument import setContext
+
+class Task(QRunnable):
+    '''
+    Calls fn(*args, **kwargs) on a worker thread. Should be started by TaskRunner.run, not directly.
+    Cancelling is cooperative: a queued task is never started and the result of a running one is dropped.
+    '''
+
+    class _Signals(QObject):
+        succeeded = pyqtSignal(object)
+        failed = pyqtSignal(object)
+        progressed = pyqtSignal(object)
+        finished = pyqtSignal()
+
+    def __init__(self, name: str, fn, args: tuple, kwargs: dict, context: dict = None):
+        super().__init__()
+        self.setAutoDelete(False) # the runner keeps the reference until it is finished
+        self.name = name
+        self.signals = Task._Signals()
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._cancelled = False
+        self.context = context
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    def isCancelled(self) -> bool:
+        return self._cancelled
+
+    def reportProgress(self, info) -> None:
+        '''
+        Callable from fn (passed as its "progress" keyword argument when the task has an onProgress handler)
+        '''
+        if not self._cancelled:
+            self.signals.progressed.emit(info)
+
+    def run(self):
+        setContext(self.context) # tags the DB calls of fn in the logs
+        try:
+            if self._cancelled:
+                return
+            res = self._fn(*self._args, **self._kwargs)
+            if not self._cancelled:
+                self.signals.succeeded.emit(res)
+        except Exception as e:
+            if not self._cancelled:
+                self.signals.failed.emit(e)
+        finally:
+            setContext(None)
+            self.signals.finished.emit()
+
+class TaskRunner(QObject):
+    '''
+    Runs Tasks on a QThreadPool and keeps track of the ones in flight.
+    Tasks sharing a "queue" key run one after another in submission order, e.g. the writes of 1 window.
+    '''
+
+    changed = pyqtSignal(list) # names of the tasks in flight
+
+    def __init__(self, maxThreads: int = None):
+        super().__init__()
+        self.pool = QThreadPool()
+        if maxThreads is not None:
+            self.pool.setMaxThreadCount(maxThreads)
+        self.errorHandler = None
+        self._inFlight = []
+        self._queues = {}
+
+    def run(self, name: str, fn, *args, onSuccess=None, onError=None, onProgress=None, onFinish=None, queue=None, context=None, **kwargs) -> Task:
+        '''
+        Handlers are called on the GUI thread and never after the task has been cancelled (except onFinish).
+        onError defaults to the runner's errorHandler. context: see instrument.setContext.
+        '''
+        task = Task(name, fn, args, kwargs, context)
+        if onProgress is not None:
+            kwargs['progress'] = task.reportProgress
+            task.signals.progressed.connect(lambda info: None if task.isCancelled() else onProgress(info))
+        if onSuccess is not None:
+            task.signals.succeeded.connect(lambda res: None if task.isCancelled() else onSuccess(res))
+        if onError is None:
+            onError = self.errorHandler
+        if onError is not None:
+            task.signals.failed.connect(lambda e: None if task.isCancelled() else onError(e))
+        task.signals.finished.connect(lambda: self._onFinished(task, queue, onFinish))
+
+        self._inFlight.append(task)
+        self.changed.emit(self.names())
+
+        if queue is None:
+            self.pool.start(task)
+        elif queue in self._queues:
+            self._queues[queue].append(task)
+        else:
+            self._queues[queue] = deque()
+            self.pool.start(task)
+        return task
+
+    def _onFinished(self, task: Task, queue, onFinish) -> None:
+        if task in self._inFlight:
+            self._inFlight.remove(task)
+        self.changed.emit(self.names())
+
+        if queue is not None and queue in self._queues:
+            waiting = self._queues[queue]
+            if len(waiting) > 0:
+                self.pool.start(waiting.popleft())
+            else:
+                del self._queues[queue]
+
+        if onFinish is not None:
+            onFinish()
+
+    def names(self) -> list:
+        return [t.name for t in self._inFlight]
+
+    def cancel(self, tasks: list) -> None:
+        for t in tasks:
+            if t is not None:
+                t.cancel()
+
+    def cancelAll(self) -> None:
+        self.cancel(self._inFlight)
+
+    def attachStatusBar(self, statusBar: QStatusBar) -> None:
+        label = QLabel('', statusBar)
+        statusBar.addWidget(label)
+
+        def update(names):
+            if len(names) == 0:
+                label.setText('')
+            else:
+                label.setText('Running (%d): %s' % (len(names), ', '.join(names)))
+
+        self.changed.connect(update)
@@ -0,0 +1,116 @@
+'''
+Avatar thumbnails: decoded and downsized on worker threads, cached in memory (LRU) and on disk.
+Avatars of the store (see avatars.py) are fetched as their pre-rendered thumbnail instead.
+'''
+
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+from avatars import isRef, readScaled, imageReader
+
+class THUMB:
+    SIZE = 128 # px, the bounding square
+    MEMORY_ENTRIES = 64 # pixmaps kept by the LRU
+    FOLDER = './cache/thumbnails'
+    DISK_ENTRIES = 1000 # files kept on disk, the least recently written ones are pruned
+
+def _key(path: str, size: int) -> str:
+    '''
+    Changes with the file: a replaced image never shows its old thumbnail. Stored avatars never change.
+    '''
+    if isRef(path):
+        return sha1(('%s|%d' % (path, size)).encode('UTF-8')).hexdigest()
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return sha1(('%s|%d|%d|%d' % (path, st.st_mtime_ns, st.st_size, size)).encode('UTF-8')).hexdigest()
+
+def _prune(folder: str, keep: int) -> None:
+    try:
+        files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.png')]
+        if len(files) > keep:
+            files.sort(key=os.path.getmtime)
+            for f in files[:len(files) - keep]:
+                os.remove(f)
+    except:
+        pass # ignore, pruning is best effort
+
+class ThumbnailCache:
+    '''
+    get(path, onReady) calls onReady(pixmap) on the GUI thread: at once on a memory hit, otherwise once a task has
+    loaded the thumbnail from the disk cache, or decoded the image, or fetched it if path is an avatar reference.
+    fetch(ref, size) -> PNG bytes or None. Requests for a thumbnail in flight share its task.
+    '''
+
+    def __init__(self, tasks, fetch=None, size: int = THUMB.SIZE, folder: str = THUMB.FOLDER):
+        self.tasks = tasks
+        self.fetch = fetch
+        self.size = size
+        self.folder = folder
+        self._memory = OrderedDict()
+        self._pending = {}
+
+    def get(self, path: str, onReady, onError=None) -> None:
+        try:
+            key = _key(path, self.size)
+        except OSError as e:
+            if onError is not None:
+                onError(e)
+            return
+
+        pix = self._memory.get(key)
+        if pix is not None:
+            self._memory.move_to_end(key)
+            onReady(pix)
+            return
+
+        if key in self._pending:
+            self._pending[key].append((onReady, onError))
+            return
+        self._pending[key] = [(onReady, onError)]
+
+        def loaded(img):
+            pix = QPixmap.fromImage(img) # pixmaps belong to the GUI thread
+            self._memory[key] = pix
+            while len(self._memory) > THUMB.MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+            for ready, err in self._pending.pop(key, []):
+                ready(pix)
+
+        def failed(e):
+            handled = False
+            for ready, err in self._pending.pop(key, []):
+                if err is not None:
+                    err(e)
+                    handled = True
+            if not handled and self.tasks.errorHandler is not None:
+                self.tasks.errorHandler(e)
+
+        self.tasks.run('Thumbnail of %s' % os.path.basename(path), self._load, path, key, onSuccess=loaded, onError=failed)
+
+    def _load(self, path: str, key: str) -> QImage:
+        '''
+        Runs on a worker thread
+        '''
+        cached = os.path.join(self.folder, key + '.png')
+        if os.path.isfile(cached):
+            img = QImage(cached)
+            if not img.isNull():
+                return img
+
+        if isRef(path):
+            data = self.fetch(path, self.size)
+            if data is None:
+                raise IOError('Unknown avatar %s' % path)
+            img = readScaled(imageReader(data), self.size) # the rendition may be larger than asked for
+        else:
+            img = readScaled(QImageReader(path), self.size)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp = cached + '.%d.tmp' % os.getpid()
+            if img.save(tmp, 'PNG'):
+                os.replace(tmp, cached) # never a half written thumbnail for the other instances
+            _prune(self.folder, THUMB.DISK_ENTRIES)
+        except OSError:
+            pass # ignore, the disk cache is optional
+        return img
@@ -4,14 +4,21 @@ UI layouts and modules.
 
 from hashlib import sha256
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QMenu, QAction, qApp, QWidget, QVBoxLayout, QLabel, QTabWidget, QGroupBox, QLineEdit, QPushButton, QHBoxLayout, QFileDialog, QScrollArea, QSizePolicy, QGridLayout, QTableWidget, QTableWidgetItem, QDateEdit, QCheckBox, QComboBox, QToolBar, QMessageBox, QItemDelegate, QFormLayout
+from PyQt5.QtWidgets import QApplication, QMainWindow, QMenu, QAction, qApp, QWidget, QVBoxLayout, QLabel, QTabWidget, QGroupBox, QLineEdit, QPushButton, QHBoxLayout, QFileDialog, QScrollArea, QSizePolicy, QGridLayout, QTableView, QDateEdit, QCheckBox, QComboBox, QToolBar, QMessageBox, QItemDelegate, QFormLayout, QSpinBox
 from PyQt5.QtGui import QCloseEvent, QPixmap
-from PyQt5.QtCore import Qt, QDate, QSettings, QItemSelectionModel
+from PyQt5.QtCore import Qt, QDate, QSettings
 import qtawesome as qta
 from datetime import date, datetime
 
 import db
 from log import Logger
+from tasks import TaskRunner
+from thumbnails import THUMB, ThumbnailCache
+from ids import IdService
+from feed import FEED, ChangeSubscriber
+from instrument import METRICS, metrics
+from log import PATH_LOG_FOLDER
+from models import KIND, CHANGE, Change, Column, PagedTableModel, setColumnDelegates, keepSortIndicator
 
 class ID:
     WINDOW_MAIN = 'main'
@@ -26,10 +33,15 @@ class MainApp:
     _app = None
     _mainWindow = None
     _logger = None
+    _tasks = None
+    _thumbnails = None
+    _ids = None
+    _feed = None
 
-    _GID = 'global.id'
     _AUTO_CONNECT = 'auto_connect'
     _AUTO_FILL_PASS = 'auto_fill_password'
+    _SLOW_QUERY_MS = 'slow_query_ms'
+    _STRUCTURED_LOG = 'structured_log'
     _settings = None
     
     _i = 1
@@ -41,8 +53,15 @@ class MainApp:
         MainApp._instance = self
         MainApp._dbWrapper = db.Wrapper()
         MainApp._settings = QSettings('app.ini', QSettings.IniFormat)
+        metrics.slowMs = int(MainApp._settings.value(MainApp._SLOW_QUERY_MS, METRICS.SLOW_MS))
         MainApp._app = QApplication(sys.argv)
-        MainApp._logger = Logger()
+        MainApp._logger = Logger(structured=int(MainApp._settings.value(MainApp._STRUCTURED_LOG, 0)) != 0)
+        MainApp._tasks = TaskRunner()
+        MainApp._tasks.errorHandler = MainApp._logger.error
+        MainApp._ids = IdService(MainApp._settings, lambda: MainApp._dbWrapper.redis, MainApp._tasks)
+        MainApp._feed = ChangeSubscriber()
+        MainApp._feed.received.connect(MainApp._onRemoteChanges)
+        MainApp._thumbnails = ThumbnailCache(MainApp._tasks, lambda ref, size: MainApp._dbWrapper.getAvatar(ref, size))
         MainApp._mainWindow = MainWindow()
 
         autoConnect = MainApp._settings.value(MainApp._AUTO_CONNECT, 0)
@@ -73,6 +92,16 @@ class MainApp:
         MainApp.getInstance()
         return MainApp._logger 
 
+    @staticmethod
+    def getTasks() -> TaskRunner:
+        MainApp.getInstance()
+        return MainApp._tasks
+
+    @staticmethod
+    def getThumbnails() -> ThumbnailCache:
+        MainApp.getInstance()
+        return MainApp._thumbnails
+
     @staticmethod
     def getClientID() -> int:
         j = MainApp._i
@@ -80,15 +109,12 @@ class MainApp:
         return j
 
     def getGlobalID() -> int:
-        res = MainApp._settings.value(MainApp._GID, 0)
-        if res == 0:
-            res = 1
-        else:
-            res = int(res)
-            res += 1
-        MainApp._settings.setValue(MainApp._GID, res)
-        MainApp._settings.sync()
-        return res
+        return MainApp._ids.next()
+
+    @staticmethod
+    def getIds() -> IdService:
+        MainApp.getInstance()
+        return MainApp._ids
 
     @staticmethod
     def getClients() -> dict:
@@ -105,6 +131,38 @@ class MainApp:
             for i in MainApp._clients[key]:
                 if i != callerId:
                     MainApp._clients[key][i].refresh()
+
+    @staticmethod
+    def signalChanges(key: str, callerId: int, changes: list) -> None:
+        '''
+        Let the other windows patch only the changed rows, a full refresh is the fallback
+        '''
+        if key in MainApp._clients:
+            for i in MainApp._clients[key]:
+                if i != callerId:
+                    window = MainApp._clients[key][i]
+                    try:
+                        window.applyChanges(changes)
+                    except Exception as e:
+                        MainApp.getLogger().error(e)
+                        window.refresh()
+
+    @staticmethod
+    def getFeed() -> ChangeSubscriber:
+        MainApp.getInstance()
+        return MainApp._feed
+
+    @staticmethod
+    def _onRemoteChanges(topic: str, changes: list) -> None:
+        '''
+        Writes of the other app instances, from the change feed
+        '''
+        windows = {FEED.EMPLOYEES: CLIENTS.HR_MANAGE, FEED.PRODUCTS: CLIENTS.PRODUCT_MANAGE, FEED.MEMBERS: CLIENTS.ACC}
+        if topic not in windows:
+            return
+        key = windows[topic]
+        window = CLIENTS.WINDOWS[key]
+        MainApp.signalChanges(key, None, [Change(kind, k, None if values is None else window.fromFeed(values)) for kind, k, values in changes])
         
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -141,9 +199,11 @@ class MainWindow(QMainWindow):
         self.statusBar = statusBar
         self.labelBug = QLabel('Using mouse wheel to scroll on Clients frame currently has bugs. Just use the scroll bar!', statusBar)
         statusBar.addPermanentWidget(self.labelBug)
+        MainApp.getTasks().attachStatusBar(statusBar)
 
     def closeEvent(self, event: QCloseEvent) -> None:
         super().closeEvent(event)
+        MainApp.getTasks().cancelAll()
         qApp.quit()
 
     class _MainTabGroup(QTabWidget):
@@ -364,6 +424,25 @@ class MainWindow(QMainWindow):
             self.showLogButton = showLogButton
             containerLayout.addWidget(showLogButton)
 
+            dumpStatsButton = QPushButton('Dump query statistics')
+            dumpStatsButton.setSizePolicy(QSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed))
+            self.dumpStatsButton = dumpStatsButton
+            containerLayout.addWidget(dumpStatsButton)
+
+            slowQueryWidget = QWidget(container)
+            slowQueryLayout = QHBoxLayout(slowQueryWidget)
+            slowQueryLayout.setContentsMargins(0, 0, 0, 0)
+            slowQueryWidget.setLayout(slowQueryLayout)
+            slowQueryLayout.addWidget(QLabel('Log queries slower than (ms):'))
+            slowQueryMs = QSpinBox(slowQueryWidget)
+            slowQueryMs.setRange(1, 600000)
+            slowQueryMs.setValue(metrics.slowMs)
+            slowQueryMs.valueChanged.connect(self._onSlowQueryMsChanged)
+            slowQueryLayout.addWidget(slowQueryMs)
+            slowQueryLayout.addStretch()
+            self.slowQueryMs = slowQueryMs
+            containerLayout.addWidget(slowQueryWidget)
+
             autoConnect = QCheckBox('Auto connect on startup')
             autoConnect.setSizePolicy(QSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed))
             self.autoConnect = autoConnect
@@ -384,15 +463,35 @@ class MainWindow(QMainWindow):
             autoFillPass.setCheckState(Qt.Checked if check == 1 else Qt.Unchecked)
             autoFillPass.stateChanged.connect(self._onAutoFillPassStateChanged)
 
+            structuredLog = QCheckBox('Also write a JSON-lines log of every query (applies on restart)')
+            structuredLog.setSizePolicy(QSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed))
+            self.structuredLog = structuredLog
+            containerLayout.addWidget(structuredLog)
+            check = int(settings.value(MainApp._STRUCTURED_LOG, 0))
+            structuredLog.setCheckState(Qt.Checked if check == 1 else Qt.Unchecked)
+            structuredLog.stateChanged.connect(self._onStructuredLogStateChanged)
+
             containerLayout.addStretch()
             return layout
 
+        def _onStructuredLogStateChanged(self):
+            settings = MainApp.getSettings()
+            check = 1 if self.structuredLog.checkState() == Qt.Checked else 0
+            settings.setValue(MainApp._STRUCTURED_LOG, check)
+            settings.sync()
+
         def _onAutoConnectStateChanged(self):
             settings = MainApp.getSettings()
             check = 1 if self.autoConnect.checkState() == Qt.Checked else 0
             settings.setValue(MainApp._AUTO_CONNECT, check)
             settings.sync()
 
+        def _onSlowQueryMsChanged(self, value: int):
+            metrics.slowMs = value
+            settings = MainApp.getSettings()
+            settings.setValue(MainApp._SLOW_QUERY_MS, value)
+            settings.sync()
+
         def _onAutoFillPassStateChanged(self):
             settings = MainApp.getSettings()
             check = 1 if self.autoFillPass.checkState() == Qt.Checked else 0
@@ -430,6 +529,7 @@ class MainWindow(QMainWindow):
         advancedTab = self.mainTabGroup.advancedTab
         advancedTab.createDataButton.clicked.connect(self._onCreateData)
         advancedTab.showLogButton.clicked.connect(self._showLogWindow)
+        advancedTab.dumpStatsButton.clicked.connect(self._dumpQueryStats)
 
     def _onDBFileBrowse(self):
         fpath = QFileDialog.getOpenFileName(self, caption='Select a JSON file storing DBMS connection information', directory='./', filter='JSON (*.json)')
@@ -443,116 +543,145 @@ class MainWindow(QMainWindow):
         createDataButton = self.mainTabGroup.advancedTab.createDataButton
         clientFrame = self.mainTabGroup.mainTab.clientFrame
         dbWrapper = MainApp.getDB()
-        logger = MainApp.getLogger()
-        statusBar = self.statusBar
-
-        statusBar.showMessage('Executing...')
-        try:
-            if connectButton.text() == 'Connect':
-                connectButton.setDisabled(True)
-                connectLabel.setText('Connecting...')
-                connectLabel.show()
-                connectInput.setDisabled(True)
-                browseButton.setDisabled(True)
-                self.mainTabGroup.mainTab.connectionGroup.repaint()
-
-                dbWrapper.connect(self.mainTabGroup.mainTab.connectionInput.text())
-    
-                connectLabel.setText('All DBMSs connected. Finding data...')
-                logger.log('CONNECTIONS FINISHED: All DBMS connections have been successfully established!')
-
-                # Check for data availability and auto create if needed
-                data = dbWrapper.sampleData
-                checks = data.checkDataAvailability()
-
-                str1 = 'Found existing databases of: '
-                str2 = 'Creating sample data for: '
-                allCheck = True
-                noCheck = True
-                fDict = {'mysql': data.createMySQL, 'neo4j': data.createNeo4j, 'mongo': data.createMongo, 'redis': data.createRedis}
-                fList = []
-                for i in checks:
-                    if not checks[i]:
-                        allCheck = False
-                        str2 += i + ', '
-                        fList.append(fDict[i])
-                    else:
-                        noCheck = False
-                        str1 += i + ', '
-                if allCheck:
-                    logger.log('ALL DATABASES FOUND!')
-                else:
-                    if noCheck:
-                        logger.log('NO DATABASE FOUND: Creating all 5 sample databases...')
-                        connectLabel.setText('No database found. Creating sample databases...')
-                    else:
-                        resStr = str1[:-2] + '. ' + str2[:-2] + '...'
-                        logger.log('SOME DATABASE FOUND: ' + resStr)
-                        connectLabel.setText('Some database(s) found. Creating other samples...')
-
-                    connectLabel.repaint()
-                    for f in fList:
-                        f()
-                    logger.log('SAMPLE DATA CREATED!')
-
-                connectLabel.setText('Picking up databases...')
-                connectLabel.repaint()
-                logger.log('Picking up databases...')
-                dbWrapper.pickupDatabase()
-                logger.log('ALL DATABASES PICKED UP!')
-
-                connectLabel.setText('Connected')
-                createDataButton.setEnabled(True)
-                connectButton.setText('Disconnect')
-                clientFrame.setEnabled(True)
-                connectButton.setEnabled(True)
-
-            else: # Disconnect action
-                dbWrapper.disconnect()
-                connectLabel.hide()
-                connectButton.setText('Connect')
-                connectInput.setEnabled(True)
-                browseButton.setEnabled(True)
-                clientFrame.setDisabled(True)
-                createDataButton.setDisabled(True)
-                logger.log('CONNECTIONS DROPPED: Disconnected from all DBMSs!')
-
-            statusBar.clearMessage()
-            statusBar.showMessage('Done', 3000)
+        tasks = MainApp.getTasks()
 
-        except Exception as e:
-            connectLabel.setText('Something\'s wrong! Please check the logs...')
+        self.statusBar.showMessage('Executing...')
+        connectButton.setDisabled(True)
+        if connectButton.text() == 'Connect':
+            connectLabel.setText('Connecting...')
             connectLabel.show()
-            connectInput.setEnabled(True)
-            browseButton.setEnabled(True)
+            connectInput.setDisabled(True)
+            browseButton.setDisabled(True)
+            tasks.run('Connecting', MainWindow._connectAndPrepare, connectInput.text(), onProgress=connectLabel.setText, onSuccess=self._onDBConnected, onError=self._onDBConnectFailed)
+
+        else: # Disconnect action
+            MainApp.getFeed().stop()
             clientFrame.setDisabled(True)
             createDataButton.setDisabled(True)
-            connectButton.setText('Connect')
-            connectButton.setEnabled(True)
-            logger.error(e)
+            tasks.run('Disconnecting', dbWrapper.disconnect, onSuccess=self._onDBDisconnected, onError=self._onDBConnectFailed)
+
+    @staticmethod
+    def _connectAndPrepare(credentialsPath: str, progress) -> None:
+        '''
+        Runs on a worker thread: connect, check data availability, create missing sample data and pick up the databases
+        '''
+        dbWrapper = MainApp.getDB()
+        logger = MainApp.getLogger()
+
+        status = dbWrapper.connect(credentialsPath)
+
+        progress('All DBMSs connected. Finding data...')
+        logger.log('CONNECTIONS FINISHED: All DBMS connections have been successfully established!\n' + '\n'.join(str(status[i]) for i in status))
+
+        # Check for data availability and auto create if needed
+        data = dbWrapper.sampleData
+        checks = data.checkDataAvailability()
+
+        str1 = 'Found existing databases of: '
+        str2 = 'Creating sample data for: '
+        allCheck = True
+        noCheck = True
+        missing = []
+        for i in checks:
+            if not checks[i]:
+                allCheck = False
+                str2 += i + ', '
+                missing.append(i)
+            else:
+                noCheck = False
+                str1 += i + ', '
+        if allCheck:
+            logger.log('ALL DATABASES FOUND!')
+        else:
+            if noCheck:
+                logger.log('NO DATABASE FOUND: Creating all 5 sample databases...')
+                progress('No database found. Creating sample databases...')
+            else:
+                resStr = str1[:-2] + '. ' + str2[:-2] + '...'
+                logger.log('SOME DATABASE FOUND: ' + resStr)
+                progress('Some database(s) found. Creating other samples...')
+
+            def onSeeded(status):
+                logger.log('SAMPLE DATA: %s' % status)
+                progress('Sample data for %s %s...' % (status.backend, 'created' if status.ok else 'FAILED'))
+
+            dbWrapper.createSampleData(missing, onSeeded) # in parallel, raises if any failed
+            logger.log('SAMPLE DATA CREATED!')
 
-            statusBar.clearMessage()
-            statusBar.showMessage('Error', 3000)     
+        progress('Picking up databases...')
+        logger.log('Picking up databases...')
+        dbWrapper.pickupDatabase()
+        logger.log('ALL DATABASES PICKED UP!')
+
+    def _onDBConnected(self, res):
+        mainTab = self.mainTabGroup.mainTab
+        mainTab.connectStatusLabel.setText('Connected')
+        self.mainTabGroup.advancedTab.createDataButton.setEnabled(True)
+        mainTab.connectButton.setText('Disconnect')
+        mainTab.clientFrame.setEnabled(True)
+        mainTab.connectButton.setEnabled(True)
+        MainApp.getFeed().start(MainApp.getDB().redis)
+        MainApp.getIds().leaseAhead()
+
+        self.statusBar.clearMessage()
+        self.statusBar.showMessage('Done', 3000)
+
+    def _onDBDisconnected(self, res):
+        mainTab = self.mainTabGroup.mainTab
+        mainTab.connectStatusLabel.hide()
+        mainTab.connectButton.setText('Connect')
+        mainTab.connectButton.setEnabled(True)
+        mainTab.connectionInput.setEnabled(True)
+        mainTab.connectionBrowseButton.setEnabled(True)
+        MainApp.getLogger().log('CONNECTIONS DROPPED: Disconnected from all DBMSs!')
+
+        self.statusBar.clearMessage()
+        self.statusBar.showMessage('Done', 3000)
+
+    def _onDBConnectFailed(self, e: Exception):
+        mainTab = self.mainTabGroup.mainTab
+        mainTab.connectStatusLabel.setText('Something\'s wrong! Please check the logs...')
+        mainTab.connectStatusLabel.show()
+        mainTab.connectionInput.setEnabled(True)
+        mainTab.connectionBrowseButton.setEnabled(True)
+        mainTab.clientFrame.setDisabled(True)
+        self.mainTabGroup.advancedTab.createDataButton.setDisabled(True)
+        mainTab.connectButton.setText('Connect')
+        mainTab.connectButton.setEnabled(True)
+        MainApp.getLogger().error(e)
+
+        self.statusBar.clearMessage()
+        self.statusBar.showMessage('Error', 3000)     
 
     def _onCreateData(self):
         status = self.statusBar
-        try:
-            status.showMessage('Executing...')
-            dbWrapper = MainApp.getDB()
-            logger = MainApp.getLogger()
-            logger.log('CREATING sample data...')
-            dbWrapper.createSampleData()
+        createDataButton = self.mainTabGroup.advancedTab.createDataButton
+        logger = MainApp.getLogger()
+
+        def onSuccess(res):
             logger.log('SAMPLE DATA CREATED: Initial data for all DBs have been successfully created!')
             status.clearMessage()
             status.showMessage('Done', 3000)
 
-        except Exception as e:
+        def onError(e):
             logger.error(e)
             status.showMessage('Error', 3000)
 
+        status.showMessage('Executing...')
+        createDataButton.setDisabled(True)
+        logger.log('CREATING sample data...')
+        MainApp.getTasks().run('Creating sample data', MainApp.getDB().createSampleData, onProgress=lambda res: logger.log('SAMPLE DATA: %s' % res), onSuccess=onSuccess, onError=onError, onFinish=lambda: createDataButton.setEnabled(MainApp.getDB().connected))
+
     def _showLogWindow(self):
         MainApp.getLogger().window().show()
 
+    def _dumpQueryStats(self):
+        path = PATH_LOG_FOLDER + '/query-stats-%s.json' % datetime.now().strftime('%Y%m%d-%H%M%S')
+        metrics.dumpFile(path)
+        logger = MainApp.getLogger()
+        logger.log('QUERY STATISTICS (also written to %s):\n%s' % (path, metrics.dumpText()))
+        logger.window().show()
+
     def _onOpenClient(self, key):
         wid = MainApp.getClientID()
         window = CLIENTS.WINDOWS[key](wid)
@@ -564,35 +693,107 @@ class MainWindow(QMainWindow):
 
 # =======================================================================
 
-class HRManageWindow(QMainWindow):
+class ClientWindow(QMainWindow):
+    '''
+    Base of the client windows: their DB work runs on worker threads and is cancelled when they are closed
+    '''
+
     def __init__(self, id):
         super().__init__(parent=None)
         self.id = id
+        self._tasks = []
+        self._writeQueue = 'client-%d-writes' % id # writes of 1 window must reach the DB in order
+
+    def _runTask(self, name: str, fn, *args, onFinish=None, **kwargs):
+        holder = []
+
+        def finished():
+            if holder[0] in self._tasks:
+                self._tasks.remove(holder[0])
+            if onFinish is not None:
+                onFinish()
+
+        task = MainApp.getTasks().run('Client %d - %s' % (self.id, name), fn, *args, onFinish=finished, context={'client': self.id}, **kwargs)
+        holder.append(task)
+        if kwargs.get('queue') is None: # queued writes are kept even when the window is closed
+            self._tasks.append(task)
+        return task
+
+    def _cancelTask(self, task) -> None:
+        if task is not None:
+            task.cancel()
+
+    def closeEvent(self, event: QCloseEvent) -> None:
+        MainApp.getTasks().cancel(self._tasks)
+        super().closeEvent(event)
+
+# =======================================================================
+
+class HRManageWindow(ClientWindow):
+    def __init__(self, id):
+        super().__init__(id)
         self.pending = None
+        self.jobs = self.deps = self.branches = None
 
         self.setWindowTitle('Client %d - Human Resource Manager' % id)
         self.setWindowIcon(qta.icon('fa5s.users-cog'))
         self.resize(1000, 500)
 
+        self._createFilterBoxes()
         self._createTable()
         self._createToolbar()
 
-        MainApp.getLogger().log('[Neo4j] DATA RETRIEVED')
         MainApp.getLogger().log('CLIENT STARTED: Client %s - Human Resource Manager has successfully loaded!' % self.id)
 
+    def _createFilterBoxes(self):
+        widget = QWidget(self)
+        self.centralWidget = widget
+        layout = QVBoxLayout(widget)
+        widget.setLayout(layout)
+        self.setCentralWidget(widget)
+
+        filtersWidget = QWidget(widget)
+        filtersLayout = QHBoxLayout(filtersWidget)
+        layout.addWidget(filtersWidget)
+        filtersWidget.setLayout(filtersLayout)
+
+        filtersLayout.addWidget(QLabel('Filter by'))
+        self.filterBoxes = {}
+        for key, title in [('branch', 'Branch:'), ('dep', 'Department:'), ('job', 'Job title:')]:
+            filtersLayout.addWidget(QLabel(title))
+            box = QComboBox()
+            box.addItem('All') # the options come with the lookups
+            box.currentTextChanged.connect(self._filter)
+            filtersLayout.addWidget(box)
+            self.filterBoxes[key] = box
+        filtersLayout.addStretch()
+
     def _createTable(self):
-        table = QTableWidget(self)
+        '''
+        eid name birth male job dep branch
+        '''
+        columns = [Column('Mã NV', editable=False), Column('Họ và tên'), Column('Ngày sinh', KIND.DATE), Column('Nam?', KIND.BOOL), Column('Chức vụ', KIND.CHOICE, choices=lambda: self.jobs), Column('Phòng ban', KIND.CHOICE, choices=lambda: self.deps), Column('Chi nhánh', KIND.CHOICE, choices=lambda: self.branches)]
+        model = PagedTableModel(columns, HRManageWindow._fetchPage, self._runTask, 'Loading employees', sort=(1, True), parent=self)
+        self.model = model
+
+        table = QTableView(self)
         self.table = table
-        self.setCentralWidget(table)
+        self.centralWidget.layout().addWidget(table)
+        table.setModel(model)
+        setColumnDelegates(table, model)
+        table.setSelectionBehavior(QTableView.SelectRows)
+        table.setStyleSheet('QTableView::item {margin-top:1px; margin-bottom:1px}')
 
-        self._getData()
+        headers = table.horizontalHeader()
+        headers.setSortIndicator(1, Qt.AscendingOrder)
+        table.setSortingEnabled(True)
+        keepSortIndicator(table, model)
 
-        table.setStyleSheet('QTableWidget::item {margin-top:1px; margin-bottom:1px}')
-        table.resizeColumnsToContents()
-        for c in range(table.columnCount()):
-            table.setColumnWidth(c, table.columnWidth(c) + 8)
+        model.rowEdited.connect(self._updateEmpAtRow)
+        model.pageLoaded.connect(self._onPageLoaded)
+        model.modelReset.connect(self._onModelReset)
 
-        table.itemChanged.connect(self._onTextChanged)
+        self._getData()
 
     def _createToolbar(self):
         toolbar = QToolBar(self)
@@ -608,212 +809,104 @@ class HRManageWindow(QMainWindow):
 
         self.addToolBar(Qt.TopToolBarArea, toolbar)
 
-    def _onTextChanged(self, item):
-        r = item.row()
-        self._updateEmpAtRow(r)
-
-    def _getCell(self, key, dat):
+    @staticmethod
+    def _fetchLookups() -> tuple:
         dbWrapper = MainApp.getDB()
+        return dbWrapper.getJobs(), dbWrapper.getDepartments(), dbWrapper.getBranches()
 
-        if key == 'eid':
-            eid = QTableWidgetItem(dat)
-            eid.setFlags(eid.flags() ^ Qt.ItemIsEditable)
-            return eid
-
-        if key == 'name':
-            return QTableWidgetItem(dat)
-
-        if key == 'birth':
-            birth = dat
-            birth = QDate(birth.year, birth.month, birth.day)
-            birth = QDateEdit(birth)
-            birth.wheelEvent = lambda event: None
-            return birth
-
-        if key == 'male':
-            male = QWidget()
-            layout = QHBoxLayout(male)
-            check = QCheckBox(male)
-            check.setCheckState(Qt.Checked if dat else Qt.Unchecked)
-            layout.addWidget(check)
-            male.setLayout(layout)
-            layout.setContentsMargins(0, 0, 0, 0)
-            layout.setAlignment(Qt.AlignCenter)
-            return male
-
-        if key == 'job':
-            jobs = dbWrapper.getJobs()
-            job = QComboBox()
-            job.addItems(jobs)
-            job.setCurrentText(dat)
-            job.wheelEvent = lambda event: None
-            return job
-
-        if key == 'dep':
-            deps = dbWrapper.getDepartments()
-            dep = QComboBox()
-            dep.addItems(deps)
-            dep.setCurrentText(dat)
-            dep.wheelEvent = lambda event: None
-            return dep
-
-        if key == 'branch':
-            branches = dbWrapper.getBranches()
-            branch = QComboBox()
-            branch.addItems(branches)
-            branch.setCurrentText(dat)
-            branch.wheelEvent = lambda event: None
-            return branch    
-
-    def _fillRow(self, r, datList):
-        '''
-        eid name birth male job dep branch
-        '''
-        keys = ['eid', 'name', 'birth', 'male', 'job', 'dep', 'branch']
-        table = self.table
-        cells = []
-        for c in range(table.columnCount()):
-            if c < 2:
-                f = table.setItem
-            else:
-                f = table.setCellWidget
-            cell = self._getCell(keys[c], datList[c])
-            f(r, c, cell)
-            cells.append(cell)
-        return cells
+    def _setLookups(self, res):
+        self.jobs, self.deps, self.branches = res
+        for key, options in [('branch', self.branches), ('dep', self.deps), ('job', self.jobs)]:
+            box = self.filterBoxes[key]
+            current = box.currentText()
+            box.blockSignals(True)
+            box.clear()
+            box.addItems(['All'] + options)
+            box.setCurrentText(current)
+            box.blockSignals(False)
 
-    def _connectRow(self, wList):
+    _SORT_KEYS = {0: 'id', 1: 'name', 2: 'birth', 3: 'male', 4: 'job', 5: 'dep', 6: 'branch'}
+
+    @staticmethod
+    def _fetchPage(cursor, limit: int, sort: tuple, filters: dict) -> tuple:
         '''
-        birth male job dep branch
+        1 page at a time straight from Neo4j, filtered and sorted there
         '''
-        fList = [wList[0].dateChanged, wList[1].findChild(QCheckBox).stateChanged, wList[2].currentTextChanged, wList[3].currentTextChanged, wList[4].currentTextChanged]
-
-        for f in fList:
-            f.connect(self._onCellWidgetChanged)
+        column, ascending = sort
+        rows, cursor = MainApp.getDB().getEmployeePage(filters.get('branch'), filters.get('dep'), filters.get('job'), HRManageWindow._SORT_KEYS[column], ascending, cursor, limit)
+        return [[eid, name, date(birth.year, birth.month, birth.day), male in (True, 'true'), job, dep, branch] for eid, name, birth, male, job, dep, branch in rows], cursor # older edits stored male as a string
 
     def _getData(self):
-        logger = MainApp.getLogger()
-        try:
-            table = self.table
-            dbWrapper = MainApp.getDB()
-            dat = dbWrapper.getEmployees()
-
-            table.setRowCount(len(dat))
-            table.setColumnCount(7)
-            table.setHorizontalHeaderLabels(['Mã NV', 'Họ và tên', 'Ngày sinh', 'Nam?', 'Chức vụ', 'Phòng ban', 'Chi nhánh'])
-
-            for r, row in enumerate(dat):
-                emp = row['n']
-                j = row['j']
-                d = row['d']
-                b = row['b']
+        self.statusBar().showMessage('Loading...')
+        self._runTask('Loading job titles, departments, branches', HRManageWindow._fetchLookups, onSuccess=self._setLookups)
+        self.model.reload()
 
-                wList = self._fillRow(r, [emp['id'], emp['name'], emp['birth'], emp['male'], j['name'], d['name'], b['name']])
-                self._connectRow(wList[2:])
-
-            self.nameAscending = True
-            self.idAscending = False
-            table.sortByColumn(1, Qt.AscendingOrder)
-
-            headers = table.horizontalHeader()
-            headers.setSortIndicatorShown(True)
-            headers.setSortIndicator(1, Qt.AscendingOrder)
-            headers.setSectionsClickable(True)
-            headers.sectionClicked.connect(self._sortByColumn)
-
-        except Exception as e:
-            logger.error(e)
-
-    def _sortByColumn(self, column: int):
-        ascending = True
-        if column == 0:
-            self.idAscending = not self.idAscending
-            ascending = self.idAscending
-        else:
-            self.nameAscending = not self.nameAscending
-            ascending = self.nameAscending
-        self.table.sortByColumn(column, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
-
-    def _onCellWidgetChanged(self):
-        sender = self.sender()
-        if type(sender) == QCheckBox:
-            sender = sender.parent()
-        table = self.table
-        index = table.indexAt(sender.pos())
-        r = index.row()
-        self._updateEmpAtRow(r)
-        
-    def _updateEmpAtRow(self, r):
-        table = self.table
+    def _onPageLoaded(self, count: int):
+        if count <= PagedTableModel.PAGE_SIZE: # first page
+            table = self.table
+            table.resizeColumnsToContents()
+            for c in range(self.model.columnCount()):
+                table.setColumnWidth(c, table.columnWidth(c) + 8)
+            MainApp.getLogger().log('[Neo4j] DATA RETRIEVED')
+        self.statusBar().clearMessage()
 
-        eid = table.item(r, 0).text()
-        name = table.item(r, 1).text()
+    def _updateEmpAtRow(self, r: int, values: list):
+        eid, name, birth, male, job, dep, branch = values
 
         if (name.strip() == ''):
             return
 
-        state = table.cellWidget(r, 3).findChild(QCheckBox).checkState()
-        male = 'true' if state == Qt.Checked else 'false'
-        birth = table.cellWidget(r, 2).date().toString('yyyy-MM-dd')
-        job = table.cellWidget(r, 4).currentText()
-        dep = table.cellWidget(r, 5).currentText()
-        branch = table.cellWidget(r, 6).currentText()
+        def onSuccess(res):
+            MainApp.getLogger().log('[Neo4j] UPDATED/CREATED Employee %s' % eid)
+            MainApp.signalChanges(CLIENTS.HR_MANAGE, self.id, [Change(CHANGE.UPSERT, eid, values)])
 
-        MainApp.getDB().changeEmp(eid, name, birth, male, job, dep, branch)
-        MainApp.getLogger().log('[Neo4j] UPDATED/CREATED Employee %s' % eid)
-        MainApp.signalRefresh(CLIENTS.HR_MANAGE, self.id)
+        self._runTask('Saving employee %s' % eid, MainApp.getDB().changeEmp, eid, name, birth.isoformat(), male, job, dep, branch, onSuccess=onSuccess, queue=self._writeQueue)
 
-        if self.pending != None and self.pending[0] == eid:
+        if self.pending == eid:
             self.pending = None
 
     def _onCreateNewEmp(self):
         table = self.table
+        model = self.model
         table.selectionModel().clear()
 
         if self.pending is None:
             eid = 'EN' + str(MainApp.getGlobalID())
-
-            name = 'Type to edit...'
-            birth = date(1990, 1, 1)
-            male = True
-            job = 'Nhân viên'
-            dep = 'Kinh doanh'
-            branch = 'The Coffee House 1'
-
-            table.itemChanged.disconnect()
-            r = table.rowCount()
-            table.insertRow(r)
-            wList = self._fillRow(r, [eid, name, birth, male, job, dep, branch])
-            self._connectRow(wList[2:])
-            table.itemChanged.connect(self._onTextChanged)
-            table.setCurrentItem(table.item(r, 1))
-        
-            self.pending = (eid, r)
+            filters = self._filters()
+            r = model.appendRow([eid, 'Type to edit...', date(1990, 1, 1), True, filters.get('job', 'Nhân viên'), filters.get('dep', 'Kinh doanh'), filters.get('branch', 'The Coffee House 1')])
+            self.pending = eid
         else:
-            table.setCurrentItem(table.item(self.pending[1], 1), QItemSelectionModel.Select)
-        table.scrollToBottom()
-        self.resize(self.width(), self.height() + 1)
+            r = model.findRow(self.pending)
+
+        if r >= 0:
+            index = model.index(r, 1)
+            table.scrollTo(index)
+            table.setCurrentIndex(index)
+            table.edit(index)
 
     def _onDelEmps(self):
         confirm = self._delConfirm()
 
         if confirm == QMessageBox.Yes:
-            table = self.table
+            model = self.model
             dbWrapper = MainApp.getDB()
             logger = MainApp.getLogger()
-            rs = []
-            for i in table.selectionModel().selectedRows():
-                r = i.row()
-                eid = table.item(r, 0).text()
-                rs.append(r)
-                dbWrapper.delEmp(eid)
-                logger.log('[Neo4j] DELETED Employee %s' % eid)
+            rs = [i.row() for i in self.table.selectionModel().selectedRows()]
+            eids = [model.rowValues(r)[0] for r in rs]
+            model.removeRowsAt(rs)
+            if self.pending in eids:
+                self.pending = None
+
+            def delete():
+                for eid in eids:
+                    dbWrapper.delEmp(eid)
+                    logger.log('[Neo4j] DELETED Employee %s' % eid)
 
-            rs.sort(reverse=True)
-            for r in rs:
-                table.removeRow(r)
+            def onError(e):
+                logger.error(e)
+                self.refresh() # some rows may still exist
 
-            MainApp.signalRefresh(CLIENTS.HR_MANAGE, self.id)
+            self._runTask('Deleting employees', delete, onSuccess=lambda res: MainApp.signalChanges(CLIENTS.HR_MANAGE, self.id, [Change(CHANGE.DELETE, eid) for eid in eids]), onError=onError, queue=self._writeQueue)
 
     def _delConfirm(self):
         dialog = QMessageBox(self)
@@ -827,18 +920,47 @@ class HRManageWindow(QMainWindow):
         res = dialog.exec_()
         return res
 
+    def _filters(self) -> dict:
+        filters = {}
+        for key in self.filterBoxes:
+            t = self.filterBoxes[key].currentText()
+            if t != 'All':
+                filters[key] = t
+        return filters
+
+    def _filter(self):
+        self.statusBar().showMessage('Loading...')
+        self.model.setFilters(self._filters())
+
+    @staticmethod
+    def fromFeed(values: list) -> list:
+        eid, name, birth, male, job, dep, branch = values
+        return [eid, name, date.fromisoformat(birth[:10]), male in (True, 'true'), job, dep, branch]
+
+    def applyChanges(self, changes: list) -> None:
+        filters = self._filters()
+        for change in changes:
+            if change.kind != CHANGE.DELETE:
+                eid, name, birth, male, job, dep, branch = change.values
+                matches = filters.get('job', job) == job and filters.get('dep', dep) == dep and filters.get('branch', branch) == branch
+            if change.kind == CHANGE.DELETE or not matches:
+                self.model.removeKey(change.key)
+            else:
+                self.model.upsertRow(change.values)
+
+    def _onModelReset(self):
+        self.pending = None # an unsaved new row is dropped by a reload
+
     def refresh(self) -> None:
-        self.table = None
-        self.pending = None
-        self._createTable()
+        self._getData()
 
 # =======================================================================
 
-class ProductManageWindow(QMainWindow):
+class ProductManageWindow(ClientWindow):
     def __init__(self, id):
-        super().__init__(parent=None)
-        self.id = id
+        super().__init__(id)
         self.pending = None
+        self.types = None
 
         self.setWindowTitle('Client %d - Product Manager' % id)
         self.setWindowIcon(qta.icon('fa5s.mug-hot'))
@@ -848,7 +970,6 @@ class ProductManageWindow(QMainWindow):
         self._createTable()
         self._createToolbar()
 
-        MainApp.getLogger().log('[MySQL] DATA RETRIEVED')
         MainApp.getLogger().log('CLIENT STARTED: Client %s - Product Manager has successfully loaded!' % self.id)
 
     def _createFilterBoxes(self):
@@ -867,30 +988,41 @@ class ProductManageWindow(QMainWindow):
         filtersLayout.addWidget(QLabel('Product Type:'))
         filterType = QComboBox()
         self.typeFilterBox = filterType
-        types = MainApp.getDB().getProductTypes()
-        types.insert(0, 'All')
-        filterType.addItems(types)
+        filterType.addItem('All') # the types come with the data
         filtersLayout.addWidget(filterType)
         filtersLayout.addStretch()
 
         filterType.currentTextChanged.connect(self._filterByType)
 
     def _createTable(self):
-        table = QTableWidget(self)
+        '''
+        id name on from price type
+        '''
+        columns = [Column('Mã SP', KIND.INT, editable=False), Column('Tên SP'), Column('Đang kinh doanh?', KIND.BOOL), Column('Kinh doanh từ', KIND.DATE), Column('Giá', KIND.INT), Column('Loại SP', KIND.CHOICE, choices=lambda: self.types)]
+        model = PagedTableModel(columns, ProductManageWindow._fetchPage, self._runTask, 'Loading products', sort=(0, True), parent=self)
+        self.model = model
+
+        table = QTableView(self)
         self.table = table
         self.centralWidget.layout().addWidget(table)
+        table.setModel(model)
+        setColumnDelegates(table, model)
+        self.moneyDelegate = MoneyDelegate(table)
+        table.setItemDelegateForColumn(4, self.moneyDelegate)
+        table.setSelectionBehavior(QTableView.SelectRows)
+        table.setStyleSheet('QTableView::item {margin-top:1px; margin-bottom:1px}')
+
+        headers = table.horizontalHeader()
+        headers.setSortIndicator(0, Qt.AscendingOrder)
+        table.setSortingEnabled(True)
+        keepSortIndicator(table, model)
+
+        model.rowEdited.connect(self._updateProdAtRow)
+        model.pageLoaded.connect(self._onPageLoaded)
+        model.modelReset.connect(self._onModelReset)
 
         self._getData()
 
-        table.setStyleSheet('QTableWidget::item {margin-top:1px; margin-bottom:1px}')
-        table.resizeColumnsToContents()
-        for c in range(table.columnCount()):
-            table.setColumnWidth(c, table.columnWidth(c) + 8)
-
-        table.itemChanged.connect(self._onTextChanged)
-        table.setItemDelegateForColumn(4, MoneyDelegate())
-        table.setColumnWidth(4, table.columnWidth(4) + 50)
-
     def _createToolbar(self):
         toolbar = QToolBar(self)
         newAction = QAction(qta.icon('fa5s.plus'), '&New', toolbar)
@@ -905,199 +1037,146 @@ class ProductManageWindow(QMainWindow):
 
         self.addToolBar(Qt.TopToolBarArea, toolbar)
 
-    def _onTextChanged(self, item):
-        r = item.row()
-        self._updateProdAtRow(r)
-
-    def _getCell(self, key, dat):
-        dbWrapper = MainApp.getDB()
+    _SORT_KEYS = {0: 'id', 1: 'name', 2: 'on', 3: 'from', 4: 'price', 5: 'type'}
 
-        if key == 'id':
-            pid = QTableWidgetItem(str(dat))
-            pid.setFlags(pid.flags() ^ Qt.ItemIsEditable)
-            return pid
-
-        if key == 'name':
-            return QTableWidgetItem(dat)
-
-        if key == 'on':
-            on = QWidget()
-            layout = QHBoxLayout(on)
-            check = QCheckBox(on)
-            check.setCheckState(Qt.Checked if dat else Qt.Unchecked)
-            layout.addWidget(check)
-            on.setLayout(layout)
-            layout.setContentsMargins(0, 0, 0, 0)
-            layout.setAlignment(Qt.AlignCenter)
-            return on
-
-        if key == 'from':
-            sfrom = dat
-            sfrom = QDate(sfrom.year, sfrom.month, sfrom.day)
-            sfrom = QDateEdit(sfrom)
-            sfrom.wheelEvent = lambda event: None
-            return sfrom    
-
-        if key == 'price':
-            return QTableWidgetItem(str(int(dat)))
-
-        if key == 'type':
-            types = dbWrapper.getProductTypes()
-            ptype = QComboBox()
-            ptype.addItems(types)
-            ptype.setCurrentText(dat)
-            ptype.wheelEvent = lambda event: None
-            return ptype 
-
-    def _fillRow(self, r, datList):
-        '''
-        id name on from price type
-        '''
-        keys = ['id', 'name', 'on', 'from', 'price', 'type']
-        table = self.table
-        cells = []
-        for c in range(table.columnCount()):
-            if c == 0 or c == 1 or c == 4:
-                f = table.setItem
-            else:
-                f = table.setCellWidget
-            cell = self._getCell(keys[c], datList[c])
-            f(r, c, cell)
-            cells.append(cell)
-        return cells
-
-    def _connectRow(self, wList):
+    @staticmethod
+    def _fetchPage(cursor, limit: int, sort: tuple, filters: dict) -> tuple:
         '''
-        on from type
+        1 page at a time straight from MySQL, filtered and sorted there
         '''
-        fList = [wList[0].findChild(QCheckBox).stateChanged, wList[1].dateChanged, wList[2].currentTextChanged]
-
-        for f in fList:
-            f.connect(self._onCellWidgetChanged)
+        column, ascending = sort
+        rows, cursor = MainApp.getDB().getProductPage(filters.get('type'), ProductManageWindow._SORT_KEYS[column], ascending, cursor, limit)
+        return [[pid, name, bool(on), sfrom, int(price), t] for pid, name, on, sfrom, price, t in rows], cursor
 
     def _getData(self):
-        logger = MainApp.getLogger()
-        try:
+        self.statusBar().showMessage('Loading...')
+        self._runTask('Loading product types', MainApp.getDB().getProductTypes, onSuccess=self._setTypes)
+        self.model.reload()
+
+    def _setTypes(self, types: list):
+        self.types = types
+        filterType = self.typeFilterBox
+        current = filterType.currentText()
+        filterType.blockSignals(True)
+        filterType.clear()
+        filterType.addItems(['All'] + types)
+        filterType.setCurrentText(current)
+        filterType.blockSignals(False)
+
+    def _onPageLoaded(self, count: int):
+        if count <= PagedTableModel.PAGE_SIZE: # first page
             table = self.table
-            dbWrapper = MainApp.getDB()
-            dat = dbWrapper.getProducts()
+            table.resizeColumnsToContents()
+            for c in range(self.model.columnCount()):
+                table.setColumnWidth(c, table.columnWidth(c) + 8)
+            table.setColumnWidth(4, table.columnWidth(4) + 50)
+            MainApp.getLogger().log('[MySQL] DATA RETRIEVED')
+        self.statusBar().clearMessage()
 
-            table.setRowCount(len(dat))
-            table.setColumnCount(6)
-            table.setHorizontalHeaderLabels(['Mã SP', 'Tên SP', 'Đang kinh doanh?', 'Kinh doanh từ', 'Giá', 'Loại SP'])
+    def _updateProdAtRow(self, r: int, values: list):
+        pid, name, on, sfrom, price, ptype = values
 
-            for r, row in enumerate(dat):
-                wList = self._fillRow(r, row)
-                self._connectRow([wList[2], wList[3], wList[5]])
-
-            self.nameAscending = False
-            self.idAscending = True
-            self.priceAscending = False
-            table.sortByColumn(0, Qt.AscendingOrder)
-
-            headers = table.horizontalHeader()
-            headers.setSortIndicatorShown(True)
-            headers.setSortIndicator(0, Qt.AscendingOrder)
-            headers.setSectionsClickable(True)
-            headers.sectionClicked.connect(self._sortByColumn)
+        if (name.strip() == ''):
+            return
 
-        except Exception as e:
-            logger.error(e)
+        pending = self.pending if pid is None else None
+        if pid is None and pending is None: # dropped by a reload meanwhile
+            return
+        dbWrapper = MainApp.getDB()
+        row = (name, 1 if on else 0, sfrom.isoformat(), price, ptype)
+
+        def save():
+            '''
+            The new row's edits are queued behind its creation, so they find the ID it got
+            '''
+            if pending is None:
+                return pid, dbWrapper.changeProd(pid, *row) > 0
+            if pending['pid'] is None:
+                pending['pid'] = dbWrapper.createProd(*row)
+                return pending['pid'], True
+            return pending['pid'], dbWrapper.changeProd(pending['pid'], *row) > 0
+
+        def onSuccess(res):
+            saved, found = res
+            if not found: # deleted by someone else meanwhile
+                MainApp.getLogger().log('[MySQL] Product %s no longer exists, the edit was dropped' % saved)
+                self.model.removeKey(saved)
+                return
+            current = values
+            if pending is not None:
+                if pending.get('deleted'): # see _onDelProds
+                    return
+                r = self.model.findRow(None)
+                if r >= 0 and self.pending is pending:
+                    current = self.model.rowValues(r)
+                    current[0] = saved
+                    self.model.updateRow(r, current)
+                    self.pending = None
+                else:
+                    current = [saved] + values[1:]
+            MainApp.getLogger().log('[MySQL] UPDATED/CREATED Product %s' % saved)
+            MainApp.signalChanges(CLIENTS.PRODUCT_MANAGE, self.id, [Change(CHANGE.UPSERT, saved, current)])
 
-    def _sortByColumn(self, column: int):
-        ascending = True
-        if column == 0:
-            self.idAscending = not self.idAscending
-            ascending = self.idAscending
-        elif column == 1:
-            self.nameAscending = not self.nameAscending
-            ascending = self.nameAscending
-        else:
-            self.priceAscending = not self.priceAscending
-            ascending = self.priceAscending
-        self.table.sortByColumn(column, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
-
-    def _onCellWidgetChanged(self):
-        sender = self.sender()
-        if type(sender) == QCheckBox:
-            sender = sender.parent()
-        table = self.table
-        index = table.indexAt(sender.pos())
-        r = index.row()
-        self._updateProdAtRow(r)
-        
-    def _updateProdAtRow(self, r):
-        table = self.table
+        self._runTask('Saving product %s' % ('(new)' if pid is None else pid), save, onSuccess=onSuccess, queue=self._writeQueue)
 
-        pid = table.item(r, 0).text()
-        name = table.item(r, 1).text()
+    def _onCreateNewProd(self):
+        self.table.selectionModel().clear()
 
-        if (name.strip() == ''):
+        if not self.types: # not loaded yet, or no type a product could have
             return
 
-        state = table.cellWidget(r, 2).findChild(QCheckBox).checkState()
-        on = 1 if state == Qt.Checked else 0
-        sfrom = table.cellWidget(r, 3).date().toString('yyyy-MM-dd')
-        price = table.item(r, 4).text()
-        ptype = table.cellWidget(r, 5).currentText()
+        if self.pending is None:
+            self._insertNewProd()
+        else:
+            self._editRow(self.model.findRow(None))
 
-        MainApp.getDB().changeProd(pid, name, on, sfrom, price, ptype)
-        MainApp.getLogger().log('[MySQL] UPDATED/CREATED Product %s' % pid)
-        MainApp.signalRefresh(CLIENTS.PRODUCT_MANAGE, self.id)
+    def _insertNewProd(self):
+        '''
+        The row has no ID until its first save inserts it
+        '''
+        ptype = self.typeFilterBox.currentText()
+        if ptype == 'All':
+            ptype = self.types[0] # a name getTypeID knows, whatever the sample data
 
-        if self.pending != None and self.pending[0] == pid:
-            self.pending = None
+        r = self.model.appendRow([None, 'Type to edit...', True, date(2014, 1, 1), 50000, ptype])
+        self.pending = {'pid': None}
+        self._editRow(r)
 
-    def _onCreateNewProd(self):
+    def _editRow(self, r: int):
+        if r < 0:
+            return
         table = self.table
-        table.selectionModel().clear()
-
-        if self.pending is None:
-            pid = MainApp.getDB().getNewProdID()
-
-            name = 'Type to edit...'
-            on = 1
-            sfrom = date(2014, 1, 1)
-            price = 50000
-
-            ptype = self.typeFilterBox.currentText()
-            if ptype == 'All':
-                ptype = 'Cà phê'
-
-            table.itemChanged.disconnect()
-            r = table.rowCount()
-            table.insertRow(r)
-            wList = self._fillRow(r, [pid, name, on, sfrom, price, ptype])
-            self._connectRow([wList[2], wList[3], wList[5]])
-            table.itemChanged.connect(self._onTextChanged)
-            table.setCurrentItem(table.item(r, 1))
-        
-            self.pending = (pid, r)
-        else:
-            table.setCurrentItem(table.item(self.pending[1], 1), QItemSelectionModel.Select)
-        table.scrollToBottom()
-        self.resize(self.width(), self.height() + 1)
+        index = self.model.index(r, 1)
+        table.scrollTo(index)
+        table.setCurrentIndex(index)
+        table.edit(index)
 
     def _onDelProds(self):
         confirm = self._delConfirm()
 
         if confirm == QMessageBox.Yes:
-            table = self.table
+            model = self.model
             dbWrapper = MainApp.getDB()
             logger = MainApp.getLogger()
-            rs = []
-            for i in table.selectionModel().selectedRows():
-                r = i.row()
-                pid = table.item(r, 0).text()
-                rs.append(r)
-                dbWrapper.delProd(pid)
-                logger.log('[MySQL] DELETED Product %s' % pid)
+            rs = [i.row() for i in self.table.selectionModel().selectedRows()]
+            pids = [model.rowValues(r)[0] for r in rs]
+            model.removeRowsAt(rs)
+            if None in pids: # the new row
+                self._delPending(self.pending)
+                self.pending = None
+                pids.remove(None)
+            if len(pids) == 0:
+                return
+
+            def onSuccess(res):
+                logger.log('[MySQL] DELETED Product(s) %s' % ', '.join(str(p) for p in pids))
+                MainApp.signalChanges(CLIENTS.PRODUCT_MANAGE, self.id, [Change(CHANGE.DELETE, pid) for pid in pids])
 
-            rs.sort(reverse=True)
-            for r in rs:
-                table.removeRow(r)
+            def onError(e):
+                logger.error(e)
+                self.refresh() # the rows are still there
 
-            MainApp.signalRefresh(CLIENTS.PRODUCT_MANAGE, self.id)
+            self._runTask('Deleting products', dbWrapper.delProds, pids, onSuccess=onSuccess, onError=onError, queue=self._writeQueue)
 
     def _delConfirm(self):
         dialog = QMessageBox(self)
@@ -1111,23 +1190,48 @@ class ProductManageWindow(QMainWindow):
         res = dialog.exec_()
         return res
 
+    def _delPending(self, pending: dict) -> None:
+        '''
+        Queued behind the row's saves: its ID is known by then, if it was created at all
+        '''
+        pending['deleted'] = True
+        dbWrapper = MainApp.getDB()
+
+        def delete():
+            if pending['pid'] is not None:
+                dbWrapper.delProd(pending['pid'])
+            return pending['pid']
+
+        def onSuccess(pid):
+            if pid is not None:
+                MainApp.getLogger().log('[MySQL] DELETED Product %s' % pid)
+                MainApp.signalChanges(CLIENTS.PRODUCT_MANAGE, self.id, [Change(CHANGE.DELETE, pid)])
+
+        self._runTask('Deleting new product', delete, onSuccess=onSuccess, queue=self._writeQueue)
+
     def _filterByType(self):
         t = self.typeFilterBox.currentText()
-        table = self.table
+        self.statusBar().showMessage('Loading...')
+        self.model.setFilters({} if t == 'All' else {'type': t})
+
+    @staticmethod
+    def fromFeed(values: list) -> list:
+        pid, name, on, sfrom, price, ptype = values
+        return [pid, name, bool(int(on)), date.fromisoformat(sfrom[:10]), int(price), ptype]
 
-        for r in range(table.rowCount()):
-            if t == 'All' or table.cellWidget(r, 5).currentText() == t:
-                table.setRowHidden(r, False)
+    def applyChanges(self, changes: list) -> None:
+        t = self.typeFilterBox.currentText()
+        for change in changes:
+            if change.kind == CHANGE.DELETE or (t != 'All' and change.values[5] != t):
+                self.model.removeKey(change.key)
             else:
-                table.setRowHidden(r, True)
-        pass
+                self.model.upsertRow(change.values)
+
+    def _onModelReset(self):
+        self.pending = None # an unsaved new row is dropped by a reload
 
     def refresh(self) -> None:
-        self.table.setParent(None)
-        self.table = None
-        self.pending = None
-        self._createTable()
-        self._filterByType()
+        self._getData()
 
 class MoneyDelegate(QItemDelegate):
     def __init__(self, parent=None):
@@ -1144,10 +1248,9 @@ class MoneyDelegate(QItemDelegate):
 
 # =======================================================================
 
-class MemberInfo(QMainWindow):
+class MemberInfo(ClientWindow):
     def __init__(self, id):
-        super().__init__(parent=None)
-        self.id = id
+        super().__init__(id)
 
         self.setWindowTitle('Client %d - Member Account Info' % id)
         self.setWindowIcon(qta.icon('fa5s.user-lock'))
@@ -1340,12 +1443,26 @@ class MemberInfo(QMainWindow):
             self.mainWidget = None
             self._createLoginWidget()
 
+    @staticmethod
+    def _fetchLogin(acc: str, pw: str) -> tuple:
+        dbWrapper = MainApp.getDB()
+        res, dat = dbWrapper.memLogin(acc, pw)
+        if res == db.LOGIN_RESULT.SUCC and 'ava' not in dat:
+            dat['ava'] = dbWrapper.getMemAvatarPath(dat['id'])
+        return res, dat
+
     def _login(self):
+        acc = self.editName.text()
+        pw = self.editPass.text()
+        self.statusBar().showMessage('Logging in...')
+        self._runTask('Logging in', MemberInfo._fetchLogin, acc, pw, onSuccess=lambda res: self._onLoginResult(acc, res), onFinish=self.statusBar().clearMessage)
+
+    def _onLoginResult(self, acc: str, res: tuple):
         logger = MainApp.getLogger()
         try:
-            acc = self.editName.text()
-            pw = self.editPass.text()
-            res, dat = MainApp.getDB().memLogin(acc, pw)
+            res, dat = res
+            if self.loginWidget is None: # already logged in by an earlier attempt
+                return
             
             if res == db.LOGIN_RESULT.SUCC:
                 logger.log('[MongoDB] LOGIN AUTHORIZED for user %s' % acc)
@@ -1372,17 +1489,65 @@ class MemberInfo(QMainWindow):
     def _getAva(self, path=None):
         try:
             if path is None:
-                path = MainApp.getDB().getMemAvatarPath(self.dat['id'])
+                path = self.dat.get('ava', db.AVATAR.DEFAULT) # fetched together with the login
             lbl = QLabel(self)
-            pix = QPixmap(path)
+            lbl.setFixedSize(THUMB.SIZE, THUMB.SIZE) # the layout does not jump when the thumbnail arrives
+            lbl.setAlignment(Qt.AlignCenter)
             self.dat['ava'] = path
-            pix = pix.scaled(128, 128, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            lbl.setPixmap(pix)
+            self._showAva(lbl, path)
             return lbl
 
         except Exception as e:
             MainApp.getLogger().error(e)
 
+    def _showAva(self, lbl: QLabel, path: str) -> None:
+        '''
+        Decoded off the GUI thread, unless the thumbnail is cached in memory. path may be an avatar reference.
+        '''
+        self._avaShown = path
+
+        def ready(pix):
+            try:
+                if self._avaShown == path: # not replaced by a newer choice meanwhile
+                    lbl.setPixmap(pix)
+            except RuntimeError:
+                pass # ignore, logged out: the label is gone
+
+        MainApp.getThumbnails().get(path, ready, MainApp.getLogger().error)
+
+    def applyChanges(self, changes: list) -> None:
+        '''
+        The logged in member saved elsewhere: the feed only tells which member, the profile is read again
+        '''
+        for change in changes:
+            if self.mainWidget is None or change.kind != CHANGE.UPSERT or change.key != self.dat.get('id'):
+                continue
+            mid = change.key
+            self._runTask('Reloading member %s' % mid, MainApp.getDB().reloadMember, mid, onSuccess=lambda values, mid=mid: self._onReloaded(mid, values))
+
+    def _onReloaded(self, mid: str, values: dict) -> None:
+        '''
+        Shows the reloaded profile, except in the fields being edited here
+        '''
+        dat = self.dat
+        if values is None or self.mainWidget is None or dat.get('id') != mid: # deleted, or logged out meanwhile
+            return
+        b = dat['birth']
+        edits = [(self.editUsername, 'username'), (self.editFullname, 'fullname'), (self.editPhone, 'phone'), (self.editEmail, 'email'), (self.editAddress, 'address')]
+        for edit, field in edits:
+            if edit.text() == dat[field]:
+                edit.setText(values[field])
+        if self.editBirth.date() == QDate(b.year, b.month, b.day):
+            self.editBirth.setDate(QDate(values['birth'].year, values['birth'].month, values['birth'].day))
+        self.levelLabel.setText(values['level'])
+        if values['ava'] != dat.get('ava'):
+            self._showAva(self.avatar, values['ava'])
+        dat.update(values)
+        self.status.showMessage('Updated from another terminal', 3000)
+
+    def refresh(self) -> None:
+        pass # a member window shows 1 profile, kept up to date by applyChanges
+
     def _onNewPassTyped(self):
         npw = self.editPass.text()
         if npw is None or npw.strip() == '':
@@ -1394,14 +1559,10 @@ class MemberInfo(QMainWindow):
         fpath = QFileDialog.getOpenFileName(self, caption='Select a new avatar image', directory='./assets/avatars', filter='Images (*.png *jpg *.jpeg *.jfif)')
         
         fpath = fpath[0]
-        lbl = self._getAva(fpath)
-        self.topLayout.removeWidget(self.avatar)
-        self.avatar.setParent(None)
-        self.avatar = None
-        self.avatar = lbl
-        self.topLayout.addWidget(lbl, 0, 0, 3, 1)
-        self.repaint()
+        if fpath == '': # cancelled
+            return
         self.dat['ava'] = fpath
+        self._showAva(self.avatar, fpath)
 
     def _onSave(self):
         try:
@@ -1448,12 +1609,19 @@ class MemberInfo(QMainWindow):
                 dat['address'] = self.editAddress.text()
                 tmp = self.editBirth.date()
                 dat['birth'] = datetime(tmp.year(), tmp.month(), tmp.day())
-                MainApp.getDB().saveMemInfo(dat)
                 self.editPass.setText('')
                 self.confirmPass.setDisabled(True)
 
-                MainApp.getLogger().log('[MongoDB][Redis] Updated info of user %s' % dat['id'])
-                self.status.showMessage('Saved', 3000)
+                picked = dat['ava']
+
+                def onSuccess(ava):
+                    if dat['ava'] == picked: # the stored avatar from now on, unless another one was picked meanwhile
+                        dat['ava'] = ava
+                    MainApp.getLogger().log('[MongoDB][Redis] Updated info of user %s' % dat['id'])
+                    self.status.showMessage('Saved', 3000)
+
+                self.status.showMessage('Saving...')
+                self._runTask('Saving member %s' % dat['id'], MainApp.getDB().saveMemInfo, dict(dat), onSuccess=onSuccess, queue=self._writeQueue)
 
         except Exception as e:
             MainApp.getLogger().error(e)